@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare every pair of a set of data runs and a set of reference runs.
+
+Pairs are spread over a pool of worker processes, each running
+compare_hists.process on one pair. The parent appends one CSV row per
+(pair, histogram, comparator) to a results table as pairs finish, and
+records each finished pair in a done file next to the table together with
+the size of the table after its rows. A sweep started again on the same
+table cuts off any rows written after the last finished pair and skips the
+pairs already done.
+
+Pairs are scheduled grouped by ref run, and each worker keeps the
+RefSession of its last ref run, so a ref file is loaded about once per
+worker rather than once per pair.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import os
+import re
+import sys
+import numpy as np
+
+import compare_hists
+from histdata import HistData
+from refsession import RefSession
+
+Run = namedtuple('Run', ('series', 'sample', 'run', 'path'))
+
+TABLE_FIELDS = ('data_run', 'ref_run', 'name', 'comparator', 'ks', 'chi2',
+                'max_pull', 'data_entries', 'ref_entries', 'nbins', 'display')
+
+# Columns of TABLE_FIELDS taken from the info of a result
+_INFO_FIELDS = (('ks', 'KS_Val'), ('chi2', 'Chi_Squared'),
+                ('max_pull', 'Max_Pull_Val'), ('data_entries', 'Data_Entries'),
+                ('ref_entries', 'Ref_Entries'))
+
+DONE_EXT = '.done'
+
+# Run number of a DQM ROOT file, e.g. DQM_V0001_L1T_R000320002.root,
+# DQM_V0001_R000316293__ZeroBias__Run2018A-PromptReco-v2__DQMIO.root, or
+# 320002.root as dqm.DQMSession stores them
+_RUN_FILE_RE = re.compile(r'(?:^|_R)(\d+)(?:__.*)?\.root$')
+
+
+def runs_in_dir(dirname, series, sample):
+    """Return a Run for each DQM ROOT file in dirname, sorted by run."""
+    runs = []
+    for fn in sorted(os.listdir(dirname)):
+        m = _RUN_FILE_RE.search(fn)
+        if not m:
+            continue
+        runs.append(Run(series, sample, str(int(m.group(1))),
+                        os.path.join(dirname, fn)))
+    return sorted(runs, key=lambda r: int(r.run))
+
+
+def run_batch(config_dir, subsystem, data_runs, ref_runs, table_path,
+              output_dir='./out/', plugin_dir='./plugins/', workers=1,
+              render='none', cache=None):
+    """Compare each of data_runs against each of ref_runs and append the
+    results to the CSV table at table_path, resuming an earlier sweep into
+    the same table. Return the number of pairs that failed."""
+    done = _resume(table_path)
+    # Group pairs by ref run so that workers can reuse its RefSession
+    pairs = [(d, r) for r in ref_runs for d in data_runs
+             if (d.run, r.run) not in done]
+    print("{} pairs to compare, {} already done".format(
+        len(pairs), len(data_runs) * len(ref_runs) - len(pairs)))
+
+    failed = 0
+    with open(table_path, 'a', newline='') as table, \
+            open(table_path + DONE_EXT, 'a') as done_file, \
+            ProcessPoolExecutor(max(workers, 1)) as pool:
+        writer = csv.writer(table)
+        futures = {
+            pool.submit(_compare_pair, config_dir, subsystem, d, r,
+                        output_dir, plugin_dir, render, cache): (d, r)
+            for d, r in pairs}
+        for n, fut in enumerate(as_completed(futures), 1):
+            d, r = futures[fut]
+            try:
+                rows = fut.result()
+            except Exception as e:
+                failed += 1
+                print("[{}/{}] data {} ref {} failed: {}".format(
+                    n, len(pairs), d.run, r.run, e), file=sys.stderr)
+                continue
+
+            writer.writerows(rows)
+            table.flush()
+            os.fsync(table.fileno())
+            # A pair only counts as done once its rows are on disk
+            done_file.write("{} {} {}\n".format(d.run, r.run, table.tell()))
+            done_file.flush()
+            print("[{}/{}] data {} ref {}: {} rows".format(
+                n, len(pairs), d.run, r.run, len(rows)))
+    return failed
+
+
+def _compare_pair(config_dir, subsystem, data, ref, output_dir, plugin_dir,
+                  render, cache):
+    """Worker side of run_batch: return the table rows of one pair."""
+    outputs = compare_hists.process(
+        config_dir, subsystem,
+        data.series, data.sample, data.run, data.path,
+        ref.series, ref.sample, ref.run, ref.path,
+        output_dir=output_dir, plugin_dir=plugin_dir, render=render,
+        cache=cache, ref_session=_ref_session(config_dir, subsystem, ref))
+
+    rows = []
+    for out in outputs:
+        info = out['info']
+        row = {'data_run': data.run, 'ref_run': ref.run, 'name': out['name'],
+               'comparator': out['comparator'],
+               'nbins': _nbins(out['plot']), 'display': int(out['display'])}
+        for field, key in _INFO_FIELDS:
+            row[field] = info.get(key, '')
+        rows.append([row[f] for f in TABLE_FIELDS])
+    return rows
+
+
+# (key, RefSession) of the ref run a worker compared last, kept while the
+# pairs it is handed share that run
+_worker_session = None
+
+
+def _ref_session(config_dir, subsystem, ref):
+    global _worker_session
+    key = (config_dir, subsystem, ref)
+    if _worker_session is None or _worker_session[0] != key:
+        _worker_session = None
+        _worker_session = (key, RefSession(config_dir, subsystem, *ref))
+    return _worker_session[1]
+
+
+def _nbins(plot):
+    """Return the number of bins, without under- and overflow, of the first
+    histogram in the plot of a result."""
+    for value in (plot or {}).values():
+        if isinstance(value, HistData):
+            return int(np.prod([len(ax.edges) - 1 for ax in value.axes]))
+    return ''
+
+
+def _resume(table_path):
+    """Prepare table_path for appending and return the set of (data run,
+    ref run) pairs already in it."""
+    done_path = table_path + DONE_EXT
+    if not (os.path.exists(table_path) and os.path.exists(done_path)):
+        with open(table_path, 'w', newline='') as f:
+            csv.writer(f).writerow(TABLE_FIELDS)
+        open(done_path, 'w').close()
+        return set()
+
+    done = set()
+    size = None
+    with open(done_path) as f:
+        for line in f:
+            # Skip a line cut short by a crash
+            if not line.endswith('\n'):
+                continue
+            fields = line.split()
+            done.add((fields[0], fields[1]))
+            size = int(fields[2])
+    if size is None:
+        with open(table_path, newline='') as f:
+            f.readline()
+            size = f.tell()
+
+    # Drop rows of pairs that were being written when the sweep stopped
+    with open(table_path, 'r+') as f:
+        f.truncate(size)
+    return done
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (7, 8):
+        sys.exit("usage: batch.py config_dir plugin_dir subsystem data_dir "
+                 "ref_dir table_path [workers]")
+    config_dir, plugin_dir, subsystem, data_dir, ref_dir, table_path = \
+        sys.argv[1:7]
+    workers = int(sys.argv[7]) if len(sys.argv) == 8 else os.cpu_count()
+    failed = run_batch(config_dir, subsystem,
+                       runs_in_dir(data_dir, 'Run2018', 'L1T'),
+                       runs_in_dir(ref_dir, 'Run2018', 'L1T'),
+                       table_path, plugin_dir=plugin_dir, workers=workers)
+    sys.exit(1 if failed else 0)
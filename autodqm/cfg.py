@@ -18,6 +18,14 @@ def list_subsystems(cfg_dir):
     return out
 
 
+def get_subsystems(cfg_dir, subsystems=None):
+    """Return {name: configuration} of subsystems, or of every subsystem
+    in cfg_dir by name if subsystems is None."""
+    if subsystems is None:
+        subsystems = sorted(list_subsystems(cfg_dir))
+    return {s: get_subsystem(cfg_dir, s) for s in subsystems}
+
+
 def get_subsystem(cfg_dir, subsystem):
     """Return the dict-based configuration of subsystem from cfg_dir."""
     fname = subsystem + '.json'
@@ -1,22 +1,241 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import collections
 import os
 import sys
 import json
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
 import ROOT
 #from autodqm import cfg
 import cfg
+import histdata
+import result_cache
+import result_record
 #from autodqm.histpair import HistPair
 from histpair import HistPair
+import refsession
+from refsession import RefSession, error
 sys.path.insert(1, '/Users/si_sutantawibul1/Projects/2018metaAnalysis/plugins')
 
+# Choices for the render argument of process: draw every result's plot,
+# only those of results flagged for display, or none
+RENDER_MODES = ('all', 'flagged', 'none')
+
+
 def process(config_dir, subsystem,
             data_series, data_sample, data_run, data_path,
             ref_series, ref_sample, ref_run, ref_path,
-            output_dir='./out/', plugin_dir='./plugins/'):
-    
+            output_dir='./out/', plugin_dir='./plugins/', workers=1,
+            render='all', cache=None, ref_session=None, data_hists=None):
+    """Run the configured comparators over every HistPair of a subsystem.
+
+    With workers > 1 the HistPairs are spread over a pool of that many
+    processes. The output is the same, in the same order.
+
+    render is one of RENDER_MODES and selects the results whose plots are
+    drawn and saved as pdfs. Every output keeps the arrays its plot is
+    drawn from under 'plot', so render_outputs can draw the rest later.
+
+    cache is an optional ResultCache. Results found in it skip both the
+    comparator and, if its pdf was stored with it, the rendering; their
+    artifacts and hists are left empty.
+
+    ref_session is an optional RefSession of the ref run, loaded once and
+    reused across calls for different data runs. The ref_* arguments are
+    ignored when it is given.
+
+    data_hists is an optional {path below main_gdir: HistData} dict of the
+    data run, such as one read with remote.read_hists, used instead of the
+    file at data_path.
+
+    iter_process yields the same outputs one at a time instead.
+    """
+    return list(_outputs(
+        config_dir, subsystem,
+        data_series, data_sample, data_run, data_path,
+        ref_series, ref_sample, ref_run, ref_path,
+        output_dir, plugin_dir, workers, render, cache, ref_session,
+        data_hists, True))
+
+
+def iter_process(config_dir, subsystem,
+                 data_series, data_sample, data_run, data_path,
+                 ref_series, ref_sample, ref_run, ref_path,
+                 output_dir='./out/', plugin_dir='./plugins/', workers=1,
+                 render='all', cache=None, ref_session=None, data_hists=None):
+    """Yield the outputs of process one at a time, each as soon as it is
+    computed.
+
+    HistPairs are read from the data file only as they are needed, with at
+    most 2 * workers of them in flight, and the ROOT objects of an output,
+    its artifacts and hists, are dropped once the next output is asked
+    for. Memory thus stays flat however many histograms the config has.
+    Anything the caller needs of those objects must be used or copied
+    before then; the rest of the output, its 'plot' arrays included, is
+    left as it is. Without a ref_session, ref histograms are likewise read
+    per pair rather than all up front.
+    """
+    for out in _outputs(config_dir, subsystem,
+                        data_series, data_sample, data_run, data_path,
+                        ref_series, ref_sample, ref_run, ref_path,
+                        output_dir, plugin_dir, workers, render, cache,
+                        ref_session, data_hists, False):
+        yield out
+        out['artifacts'] = []
+        out['hists'] = []
+
+
+def iter_records(config_dir, subsystem,
+                 data_series, data_sample, data_run, data_path,
+                 ref_series, ref_sample, ref_run, ref_path,
+                 output_dir='./out/', plugin_dir='./plugins/', workers=1,
+                 render='none', cache=None, ref_session=None,
+                 data_hists=None):
+    """Yield a result_record.ResultRecord for each output of iter_process,
+    in the same order.
+
+    Records hold no ROOT objects, so they can be pickled and kept however
+    many there are. Nothing is drawn by default; pdfs are still written for
+    the results selected by render.
+    """
+    return _outputs(config_dir, subsystem,
+                    data_series, data_sample, data_run, data_path,
+                    ref_series, ref_sample, ref_run, ref_path,
+                    output_dir, plugin_dir, workers, render, cache,
+                    ref_session, data_hists, False, records=True)
+
+
+def process_subsystems(config_dir, subsystems,
+                       data_series, data_sample, data_run, data_path,
+                       ref_series, ref_sample, ref_run, ref_path,
+                       output_dir='./out/', plugin_dir='./plugins/',
+                       workers=1, render='all', cache=None, errors=None):
+    """Run process for several subsystems, or every one in config_dir if
+    subsystems is None, in a single pass, and return {subsystem: outputs}
+    with every subsystem asked for.
+
+    The data and ref files are opened once, and their keys indexed once,
+    for all the subsystems, and their HistPairs are run through the same
+    workers one after the other.
+
+    A subsystem with configured directories missing from either file is
+    skipped, with no outputs, rather than failing the others. Its error is
+    added to the errors dict, if given, and printed to stderr otherwise.
+    """
+    configs = cfg.get_subsystems(config_dir, subsystems)
+    outputs = {subsystem: [] for subsystem in configs}
+    for subsystem, out in _subsystem_outputs(
+            config_dir, configs,
+            data_series, data_sample, data_run, data_path,
+            ref_series, ref_sample, ref_run, ref_path,
+            output_dir, plugin_dir, workers, render, cache, True, errors):
+        outputs[subsystem].append(out)
+    return outputs
+
+
+def iter_process_subsystems(config_dir, subsystems,
+                            data_series, data_sample, data_run, data_path,
+                            ref_series, ref_sample, ref_run, ref_path,
+                            output_dir='./out/', plugin_dir='./plugins/',
+                            workers=1, render='all', cache=None,
+                            preload=False, errors=None):
+    """Yield (subsystem, output) for each output of process_subsystems as
+    it is computed, in subsystem and then config order. Subsystems are
+    skipped, and their errors reported, as in process_subsystems.
+
+    As in iter_process, the ROOT objects of an output are dropped once the
+    next one is asked for, and ref histograms are read per pair unless
+    preload is set.
+    """
+    configs = cfg.get_subsystems(config_dir, subsystems)
+    for subsystem, out in _subsystem_outputs(
+            config_dir, configs,
+            data_series, data_sample, data_run, data_path,
+            ref_series, ref_sample, ref_run, ref_path,
+            output_dir, plugin_dir, workers, render, cache, preload,
+            errors):
+        yield subsystem, out
+        out['artifacts'] = []
+        out['hists'] = []
+
+
+def _subsystem_outputs(config_dir, configs,
+                       data_series, data_sample, data_run, data_path,
+                       ref_series, ref_sample, ref_run, ref_path,
+                       output_dir, plugin_dir, workers, render, cache,
+                       preload, errors):
+    """Yield (subsystem, output) for process_subsystems in order as they
+    are computed, for the {subsystem: config} configs."""
+    _check_render(render)
+
+    data_file = refsession.open_file(data_path)
+    ref_file = refsession.open_file(ref_path)
+    try:
+        data_index = refsession.shared_index(data_file, data_run,
+                                             list(configs.values()))
+        ref_index = refsession.shared_index(ref_file, ref_run,
+                                            list(configs.values()))
+        sessions = []
+        for subsystem, config in configs.items():
+            # Check every directory before any pair of the subsystem runs,
+            # so that one is either compared whole or skipped
+            try:
+                missing = refsession.missing_dirs(data_index, data_run,
+                                                  config)
+                if missing:
+                    raise error(
+                        "Subsystem dir {0} not found in data root file"
+                        .format(missing[0]))
+                sessions.append((subsystem, RefSession(
+                    config_dir, subsystem, ref_series, ref_sample, ref_run,
+                    ref_path, preload=preload, config=config,
+                    ref_file=ref_file, ref_index=ref_index)))
+            except error as e:
+                if errors is None:
+                    print("Skipping subsystem {}: {}".format(subsystem, e),
+                          file=sys.stderr)
+                else:
+                    errors[subsystem] = e
+
+        tagged = ((subsystem, hp)
+                  for subsystem, session in sessions
+                  for hp in session.iter_bind(
+                      data_series, data_sample, data_run, data_path,
+                      data_file=data_file, data_index=data_index))
+        yield from _schedule(tagged, output_dir, plugin_dir, workers,
+                             render, cache, False)
+    finally:
+        data_file.Close()
+        ref_file.Close()
+
+
+def _outputs(config_dir, subsystem,
+             data_series, data_sample, data_run, data_path,
+             ref_series, ref_sample, ref_run, ref_path,
+             output_dir, plugin_dir, workers, render, cache, ref_session,
+             data_hists, preload, records=False):
+    """Yield the outputs of process in order as they are computed, or their
+    ResultRecords if records is set. preload is passed to the RefSession
+    made if ref_session is None."""
+    _check_render(render)
+
+    if ref_session is None:
+        ref_session = RefSession(config_dir, subsystem,
+                                 ref_series, ref_sample, ref_run, ref_path,
+                                 preload=preload)
+    histpairs = ref_session.iter_bind(data_series, data_sample, data_run,
+                                      data_path, data_hists)
+
+    for _, out in _schedule(((None, hp) for hp in histpairs), output_dir,
+                            plugin_dir, workers, render, cache, records):
+        yield out
+
+
+def _check_render(render):
+    if render not in RENDER_MODES:
+        raise error("Unknown render mode {}.".format(render))
 
     # Ensure no graphs are drawn to screen and no root messages are sent to
     # terminal
@@ -24,180 +243,272 @@ def process(config_dir, subsystem,
     # Report only errors to stderr
     ROOT.gErrorIgnoreLevel = ROOT.kWarning + 1
 
-    histpairs = compile_histpairs(config_dir, subsystem,
-                                  data_series, data_sample, data_run, data_path,
-                                  ref_series, ref_sample, ref_run, ref_path)
 
+def _schedule(tagged, output_dir, plugin_dir, workers, render, cache,
+              records):
+    """Run the comparators of each (tag, HistPair) of tagged, serially or
+    on workers, and yield (tag, output) for each of their outputs in
+    order."""
     for d in [output_dir + s for s in ['/pdfs', '/jsons', '/pngs']]:
         if not os.path.exists(d):
             os.makedirs(d)
 
-    hist_outputs = []
-
     comparator_funcs = load_comparators(plugin_dir)
-    for hp in histpairs:
+    jobs = _jobs(tagged, comparator_funcs)
+
+    if workers > 1:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(plugin_dir,)) as pool:
+            # Pairs submitted and not yet yielded, in order
+            pending = collections.deque()
+            try:
+                for tag, hp, comps in jobs:
+                    maps = result_record.pair_maps(hp) if records else None
+                    # Ship the histograms as arrays rather than pickled ROOT
+                    # objects
+                    pending.append((tag, hp, maps, pool.submit(_run_packed, (
+                        _pack_histpair(hp), [(c, i) for c, _, i in comps],
+                        output_dir, render, cache))))
+                    if len(pending) >= 2 * workers:
+                        tag, *job = pending.popleft()
+                        for out in _packed_outputs(*job):
+                            yield tag, out
+                while pending:
+                    tag, *job = pending.popleft()
+                    for out in _packed_outputs(*job):
+                        yield tag, out
+            finally:
+                for _, _, _, fut in pending:
+                    fut.cancel()
+        return
+
+    renderers = load_renderers(plugin_dir)
+    for tag, hp, comparators in jobs:
+        maps = result_record.pair_maps(hp) if records else None
+        for comp_name, result_id, results, artifacts in _run_comparators(
+                hp, comparators, output_dir, render, renderers, cache):
+            if maps is not None:
+                yield tag, result_record.make_record(
+                    hp, maps, comp_name, result_id, results.show,
+                    results.info, results.plot)
+                continue
+            yield tag, _output(
+                hp, comp_name, result_id, results.show, results.info,
+                results.plot, artifacts, _hists(artifacts))
+
+
+def _jobs(tagged, comparator_funcs):
+    """Yield each (tag, HistPair) with its (name, comparator, result id)s."""
+    for tag, hp in tagged:
         try:
             comparators = [(c, comparator_funcs[c]) for c in hp.comparators]
         except KeyError as e:
             raise error("Comparator {} was not found.".format(str(e)))
+        yield tag, hp, [(c, f, identifier(hp, c)) for c, f in comparators]
 
-        for comp_name, comparator in comparators:
 
-            result_id = identifier(hp, comp_name)
-            pdf_path = '{}/pdfs/{}.pdf'.format(output_dir, result_id)
-            #json_path = '{}/jsons/{}.json'.format(output_dir, result_id)
-            #png_path = '{}/pngs/{}.png'.format(output_dir, result_id)
+def _packed_outputs(hp, maps, future):
+    """Yield the outputs of a HistPair run by _run_packed in a worker, or
+    its records if maps is not None."""
+    for comp_name, result_id, show, info, plot, artifacts in future.result():
+        if maps is not None:
+            yield result_record.make_record(hp, maps, comp_name, result_id,
+                                            show, info, plot)
+            continue
+        artifacts = [histdata.to_hist(a) if isinstance(a, histdata.HistData)
+                     else a for a in artifacts]
+        yield _output(hp, comp_name, result_id, show, info, plot,
+                      artifacts, _hists(artifacts))
 
-            #if True:#not os.path.isfile(json_path):
-            results = comparator(hp, **hp.config)
 
-            # Continue if no results
-            if not results:
-                continue
+def render_outputs(hist_outputs, output_dir='./out/', plugin_dir='./plugins/',
+                   render='all'):
+    """Draw and save the plots of outputs of process that were not rendered,
+    selected by the render mode, filling in their artifacts and hists."""
+    ROOT.gROOT.SetBatch(ROOT.kTRUE)
+    ROOT.gErrorIgnoreLevel = ROOT.kWarning + 1
 
+    renderers = load_renderers(plugin_dir)
+    for out in hist_outputs:
+        if out['artifacts'] or not _should_render(render, out['display']):
+            continue
+        out['artifacts'] = _render(out['comparator'], out['plot'], renderers,
+                                   output_dir, out['id'])
+        out['hists'] = _hists(out['artifacts'])
+    return hist_outputs
 
-            # Make pdf
-            # results.canvas.Update()
-            results.canvas.SaveAs(pdf_path)
 
-            hists = list()
-            for i in results.root_artifacts:
-                if i.InheritsFrom('TH2') or i.InheritsFrom('TH1'):
-                    hists.append(i)
-                #if i.InheritsFrom('TH1'):
-                #    hist.append(i)
+def _run_comparators(hp, comparators, output_dir, render, renderers,
+                     cache=None):
+    """Run each (name, comparator, result id) on hp in order, rendering
+    those selected by render, and yield (name, result id, results,
+    artifacts) for those with results."""
+    # Digest the histograms before any comparator normalizes them
+    if cache is not None:
+        digest = result_cache.pair_digest(hp)
 
+    for comp_name, comparator, result_id in comparators:
 
-            # Make png
-            #subprocess.Popen(
-            #    ['convert', '-density', '50', '-trim', '-fuzz', '1%', pdf_path, png_path])
+        #json_path = '{}/jsons/{}.json'.format(output_dir, result_id)
+        #png_path = '{}/pngs/{}.png'.format(output_dir, result_id)
 
-            # Make json
-            info = {
-                'id': result_id,
-                'name': hp.data_name,
-                'comparator': comp_name,
-                'display': results.show or hp.config.get('always_show', False),
-                #'config': hp.config,
-                #'results': results.info,
-                'info': results.info,
-                #'pdf_path': pdf_path,
-                #'json_path': json_path,
-                #'png_path': png_path,
-                'artifacts': results.root_artifacts,
-                'hists' : hists
-            }
-            # with open(json_path, 'w') as jf:
-            #     json.dump(info, jf)
+        cached = None
+        if cache is not None:
+            key = result_cache.result_key(digest, comp_name, comparator)
+            cached = cache.get(key)
 
+        #if True:#not os.path.isfile(json_path):
+        if cached is None:
+            results, pdf = comparator(hp, **hp.config), None
+        else:
+            results, pdf = cached
 
-            hist_outputs.append(info)
+        # Continue if no results
+        if not results:
+            if cache is not None and cached is None:
+                cache.put(key, (None, None))
+            continue
 
-    return hist_outputs
+        artifacts = []
+        display = results.show or hp.config.get('always_show', False)
+        pdf_path = '{}/pdfs/{}.pdf'.format(output_dir, result_id)
+        if not _should_render(render, display):
+            pass
+        elif pdf is not None:
+            with open(pdf_path, 'wb') as f:
+                f.write(pdf)
+        else:
+            artifacts = _render(comp_name, results.plot, renderers,
+                                output_dir, result_id)
+            if cache is not None and os.path.exists(pdf_path):
+                with open(pdf_path, 'rb') as f:
+                    pdf = f.read()
+                cached = None
+
+        if cache is not None and cached is None:
+            cache.put(key, (results, pdf))
+
+        yield comp_name, result_id, results, artifacts
+
+
+def _should_render(render, display):
+    return render == 'all' or (render == 'flagged' and display)
+
+
+def _render(comp_name, plot, renderers, output_dir, result_id):
+    """Draw the plot of a result, save it as a pdf and return the ROOT
+    objects that make it up."""
+    if comp_name not in renderers or plot is None:
+        return []
+    canvas, artifacts = renderers[comp_name](**plot)
+
+    # Make pdf
+    pdf_path = '{}/pdfs/{}.pdf'.format(output_dir, result_id)
+    canvas.SaveAs(pdf_path)
+
+    # Make png
+    #subprocess.Popen(
+    #    ['convert', '-density', '50', '-trim', '-fuzz', '1%', pdf_path, png_path])
+
+    return artifacts
+
+
+def _hists(artifacts):
+    """Return the TH1s and TH2s among the artifacts of a comparator."""
+    hists = list()
+    for i in artifacts:
+        if _is_hist(i):
+            hists.append(i)
+        #if i.InheritsFrom('TH1'):
+        #    hist.append(i)
+    return hists
+
+
+def _is_hist(obj):
+    return obj.InheritsFrom('TH2') or obj.InheritsFrom('TH1')
+
+
+def _output(hp, comp_name, result_id, show, info, plot, artifacts, hists):
+    """Return the output dict of one comparator result."""
+    # Make json
+    info = {
+        'id': result_id,
+        'name': hp.data_name,
+        'comparator': comp_name,
+        'display': show or hp.config.get('always_show', False),
+        #'config': hp.config,
+        #'results': results.info,
+        'info': info,
+        #'pdf_path': pdf_path,
+        #'json_path': json_path,
+        #'png_path': png_path,
+        'plot': plot,
+        'artifacts': artifacts,
+        'hists' : hists
+    }
+    # with open(json_path, 'w') as jf:
+    #     json.dump(info, jf)
+    return info
+
+
+def _pack_histpair(hp):
+    """Return the fields of a HistPair with its histograms as HistData."""
+    return (hp.config,
+            hp.data_series, hp.data_sample, hp.data_run, hp.data_name,
+            histdata.from_hist(hp.data_hist),
+            hp.ref_series, hp.ref_sample, hp.ref_run, hp.ref_name,
+            histdata.from_hist(hp.ref_hist))
+
+
+def _unpack_histpair(packed):
+    """Rebuild a HistPair from the output of _pack_histpair."""
+    (config, data_series, data_sample, data_run, data_name, data_hist,
+     ref_series, ref_sample, ref_run, ref_name, ref_hist) = packed
+    return HistPair(config,
+                    data_series, data_sample, data_run, data_name,
+                    histdata.to_hist(data_hist),
+                    ref_series, ref_sample, ref_run, ref_name,
+                    histdata.to_hist(ref_hist))
+
+
+# Comparators and renderers of a worker process, loaded once by
+# _init_worker
+_worker_comparators = None
+_worker_renderers = None
+
+
+def _init_worker(plugin_dir):
+    global _worker_comparators, _worker_renderers
+    ROOT.gROOT.SetBatch(ROOT.kTRUE)
+    ROOT.gErrorIgnoreLevel = ROOT.kWarning + 1
+    _worker_comparators = load_comparators(plugin_dir)
+    _worker_renderers = load_renderers(plugin_dir)
+
+
+def _run_packed(job):
+    """Worker side of process: run the comparators of a packed HistPair and
+    return their results. Histogram artifacts are returned as HistData, the
+    others, such as text boxes, are pickled by ROOT."""
+    packed, comp_ids, output_dir, render, cache = job
+    hp = _unpack_histpair(packed)
+    comparators = [(c, _worker_comparators[c], i) for c, i in comp_ids]
+    return [(comp_name, result_id, results.show, results.info, results.plot,
+             [histdata.from_hist(a) if _is_hist(a) else a
+              for a in artifacts])
+            for comp_name, result_id, results, artifacts in _run_comparators(
+                hp, comparators, output_dir, render, _worker_renderers,
+                cache)]
 
 ## get name of all th1 and th2 in a given directory
-def getall(d, h):
-    keyName = d.GetDirectory(h)
-    for key in keyName.GetListOfKeys():
-        obj = keyName.Get(key.GetName())
-        ## this is so we don't return a null pointer
-        if obj:
-            objName = obj.GetName()
-            if obj.IsFolder():
-                for i in getall(d, h+'/'+objName):
-                    yield i
-            else:
-                if obj.InheritsFrom('TH1') or obj.InheritsFrom('TH2'):
-                    yield h+'/'+objName
-        else: 
-            
-            continue
-
 def compile_histpairs(config_dir, subsystem,
                       data_series, data_sample, data_run, data_path,
-                      ref_series, ref_sample, ref_run, ref_path):
-
-    config = cfg.get_subsystem(config_dir, subsystem)
-    # Histogram details
-    conf_list = config["hists"]
-    main_gdir = config["main_gdir"]
-
-    # ROOT files
-    data_file = ROOT.TFile.Open(data_path)
-    ref_file = ROOT.TFile.Open(ref_path)
-
-    histPairs = []
-    
-    dqmhists = []
-    for k in getall(data_file, h=f'DQMData/Run {data_run}/L1T/Run summary'):
-        dqmhists.append(k)
-    histlist = []
-
-    for hconf in conf_list:
-        # Get name of hist in root file
-        h = str(hconf["path"].split("/")[-1])
-        # Get parent directory of hist
-        
-        gdir = str(hconf["path"].split(h)[0])
-
-        data_dirname = "{0}{1}".format(main_gdir.format(data_run), gdir)
-        ref_dirname = "{0}{1}".format(main_gdir.format(ref_run), gdir)
-
-        data_dir = data_file.GetDirectory(data_dirname)
-        ref_dir = ref_file.GetDirectory(ref_dirname)
-
-        if not data_dir:
-            raise error(
-                "Subsystem dir {0} not found in data root file".format(data_dirname))
-        if not ref_dir:
-            raise error(
-                "Subsystem dir {0} not found in ref root file".format(ref_dirname))
-
-        data_keys = data_dir.GetListOfKeys()
-        ref_keys = ref_dir.GetListOfKeys()
-
-        valid_names = []
-    
-        
-        # Add existing histograms that match h to valid_names
-        if "*" not in h:
-            if data_keys.Contains(h) and ref_keys.Contains(h):
-                valid_names.append(h)
-        else:
-            # Check entire directory for files matching wildcard
-            for name in [key.GetName() for key in data_keys]:
-                if h.split("*")[0] in name and ref_keys.Contains(name):
-                    valid_names.append(name)
-                        
-        # Load the histograms and create HistPairs
-        for name in valid_names:
-            data_hist = data_dir.Get(name)
-            ref_hist = ref_dir.Get(name)
-
-            # This try/catch is a dirty way of checking that this objects are something plottable
-            try:
-                data_hist.SetDirectory(0)
-                ref_hist.SetDirectory(0)
-                histlist.append(f'{data_dirname}{name}')
-            except:
-                continue
-
-            hPair = HistPair(hconf,
-                             data_series, data_sample, data_run, name, data_hist,
-                             ref_series, ref_sample, ref_run, name, ref_hist)
-            histPairs.append(hPair)
-
-    for i in histlist: 
-        for j in dqmhists:
-            if i in j: 
-                dqmhists.remove(i)
-
-    ## write out dqmhists to a file 
-    
-
-    data_file.Close()
-    ref_file.Close()
-    return histPairs
+                      ref_series, ref_sample, ref_run, ref_path,
+                      ref_hists=None, data_hists=None):
+    ref_session = RefSession(config_dir, subsystem,
+                             ref_series, ref_sample, ref_run, ref_path,
+                             ref_hists)
+    return ref_session.bind(data_series, data_sample, data_run, data_path,
+                            data_hists)
 
 
 def load_comparators(plugin_dir):
@@ -208,22 +519,8 @@ def load_comparators(plugin_dir):
     for modname in os.listdir(plugin_dir):
         print(modname)
 
-    for modname in os.listdir(plugin_dir):
-        if modname[0] == '_' or modname[-4:] == '.pyc' or modname[0] == '.':
-            continue
-        if modname[-3:] == '.py':
-            modname = modname[:-3]
+    for mod in _load_plugins(plugin_dir):
         try:
-            sys.path.append('/home/chosila/Projects/2018metaAnalysis/plugins')
-            # mod = __import__(f"{modname}")
-            if modname == 'ks':
-                import ks as mod
-            elif modname == 'pullvals':
-                import pullvals as mod
-            else:
-                continue
-
-
             new_comps = mod.comparators()
 
         except AttributeError:
@@ -234,6 +531,35 @@ def load_comparators(plugin_dir):
     return comparators
 
 
+def load_renderers(plugin_dir):
+    """Load the plot renderers of each plugin module that has a renderers()
+    function, keyed by comparator name."""
+    renderers = dict()
+    for mod in _load_plugins(plugin_dir):
+        if hasattr(mod, 'renderers'):
+            renderers.update(mod.renderers())
+    return renderers
+
+
+def _load_plugins(plugin_dir):
+    """Yield each python module in plugin_dir."""
+    for modname in os.listdir(plugin_dir):
+        if modname[0] == '_' or modname[-4:] == '.pyc' or modname[0] == '.':
+            continue
+        if modname[-3:] == '.py':
+            modname = modname[:-3]
+        sys.path.append('/home/chosila/Projects/2018metaAnalysis/plugins')
+        # mod = __import__(f"{modname}")
+        if modname == 'ks':
+            import ks as mod
+        elif modname == 'pullvals':
+            import pullvals as mod
+        else:
+            continue
+
+        yield mod
+
+
 def identifier(hp, comparator_name):
     """Return a `hashed` identifier for the histpair"""
     data_id = "DATA-{}-{}-{}".format(hp.data_series,
@@ -245,12 +571,8 @@ def identifier(hp, comparator_name):
         name_id = "DATANAME-{}_REFNAME-{}".format(hp.data_name, hp.ref_name)
     comp_id = "COMP-{}".format(comparator_name)
 
-    hash_snippet = str(hash(hp))[-5:]
+    hash_snippet = hp.digest()[-5:]
 
     idname = "{}_{}_{}_{}_{}".format(
         data_id, ref_id, name_id, comp_id, hash_snippet)
     return idname
-
-
-class error(Exception):
-    pass
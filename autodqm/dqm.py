@@ -1,17 +1,49 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import base64
 import errno
+import fcntl
+import functools
+import hashlib
+import html
 import json
 import lxml.html
 import os
+import queue
+import re
 import requests
+import tempfile
+import threading
+import time
+import urllib3
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from requests_futures.sessions import FuturesSession
+from urllib.parse import urljoin
 
 TIMEOUT = 5
 
+# Default number of pages crawl requests at once, and of times it retries a
+# page
+CRAWL_CONCURRENT = 16
+CRAWL_RETRIES = 2
+# Wait before the first retry of a page, in seconds, doubled for each next
+CRAWL_BACKOFF = 0.1
+
+# Default number of run files fetch_runs downloads at once
+MAX_CONCURRENT = 4
+
+# Default number of runs prefetch_runs downloads ahead of the one in use
+PREFETCH_AHEAD = 2
+
+# Bounds of the read size of downloads, in bytes, and the time each read
+# aims to take, in seconds
+MIN_CHUNK = 1 << 16
+MAX_CHUNK = 1 << 23
+CHUNK_SECONDS = 0.1
+
 BASE_URL = 'https://cmsweb.cern.ch'
 DQM_URL = 'https://cmsweb.cern.ch/dqm/offline/data/browse/ROOT/OfflineData/'
 CA_URL = 'https://cafiles.cern.ch/cafiles/certificates/CERN%20Root%20Certification%20Authority%202.crt'
@@ -19,18 +51,91 @@ CA_URL = 'https://cafiles.cern.ch/cafiles/certificates/CERN%20Root%20Certificati
 # The following are appended to the db dir
 CACHE_DIR = 'cache/'
 CA_PATH = 'CERN_Root_CA.crt'
+# Runs exempt from eviction from the run file cache
+PINS_PATH = 'pinned.json'
+
+# Lifetimes of the cached DQM pages, in seconds, by level. Run directory
+# pages are keyed by the directory's date as well as its url, so they only
+# go stale once the directory changes and the entry is orphaned.
+CACHE_TTL = {
+    'series': 24 * 3600,
+    'samples': 24 * 3600,
+    'macroruns': 3600,
+    'runs': 30 * 24 * 3600,
+}
+# Appended to the cache dir, holds the run index of each series and sample.
+# An index is rebuilt from the run directory listing, so it goes stale with
+# it, after CACHE_TTL['macroruns'].
+INDEX_DIR = 'index'
+
+# Appended to the path of a file while it is being downloaded
+PART_EXT = '.part'
+# Appended to the path of a part file, holds the ETag or Last-Modified of
+# the version of the file it is part of
+VALIDATOR_EXT = '.validator'
 
 StreamProg = namedtuple('StreamProg', ('cur', 'total', 'path'))
+# Progress of fetch_runs/stream_runs. cur, total and path are those of the
+# run whose download advanced, the other fields cover every run requested.
+# finished is the FileStat of run when this is its last update, else None.
+RunsProg = namedtuple('RunsProg', (
+    'run', 'cur', 'total', 'path', 'files_done', 'files_total', 'bytes_done',
+    'bytes_total', 'rate', 'finished'))
+# rate is in bytes per second, counting only the bytes transferred, and
+# None for runs that were already cached
+FileStat = namedtuple('FileStat', ('run', 'path', 'size', 'seconds', 'rate'))
+# Summary returned by fetch_runs, with paths keyed by run and files the
+# FileStat of each run in the order they finished. size is that of the
+# files that were not cached, and rate is size over the whole call.
+FetchReport = namedtuple('FetchReport', ('paths', 'files', 'size', 'seconds',
+                                         'rate'))
 DQMRow = namedtuple('DQMRow', ('name', 'full_name', 'url', 'size', 'date'))
+# Run yielded by prefetch_runs, with the seconds the caller waited for its
+# download, which is 0 when the prefetch kept up
+PrefetchedRun = namedtuple('PrefetchedRun', ('run', 'path', 'wait'))
+# Counters of the run file cache over the life of a session. hits and
+# misses count run files found in the db or downloaded, bytes_saved is the
+# size of the files found, and evicted and bytes_evicted count the files
+# removed to keep the db within its budget. parts_evicted and
+# bytes_parts_evicted count the part files of interrupted downloads removed
+# to the same end.
+RunCacheStats = namedtuple('RunCacheStats', (
+    'hits', 'misses', 'bytes_saved', 'bytes_fetched', 'evicted',
+    'bytes_evicted', 'parts_evicted', 'bytes_parts_evicted'))
+
+# Parser of DQM listing pages, 'fast' to scan the fixed row layout with a
+# regular expression, falling back to lxml on pages it does not fit, or
+# 'lxml' to always build the document tree
+PAGE_PARSER = 'fast'
+# A listing row, <tr><td><a href="url">full_name</a></td><td>size</td>
+# <td>date</td></tr>, with any attributes and with whitespace only between
+# the cells, where lxml would not take it for cell text
+_ROW_RE = re.compile(
+    r'<tr\b[^>]*>\s*'
+    r'<td\b[^>]*><a\b[^>]*?\shref\s*=\s*["\']([^"\'>]*)["\'][^>]*>'
+    r'([^<]+)</a></td>\s*'
+    r'<td\b[^>]*>([^<]+)</td>\s*'
+    r'<td\b[^>]*>([^<]+)</td>\s*'
+    r'</tr>', re.IGNORECASE)
+_TR_RE = re.compile(r'<tr\b', re.IGNORECASE)
+# Characters of a link that make urljoin do more than append it to a path
+_URL_SPECIAL = frozenset('?#;\t\r\n')
 
 
 class DQMSession(FuturesSession):
     """Encapsulates an interface to DQM Offline."""
 
-    def __init__(self, cert, db, cache=None, workers=16):
+    def __init__(self, cert, db, cache=None, workers=16, max_bytes=None):
+        """max_bytes is the disk budget of the run files in db and of the
+        part files of their downloads, beyond which the least recently used
+        runs that are not pinned are removed, or None to keep every run."""
         super(DQMSession, self).__init__(max_workers=workers)
 
         self.db = db
+        self.max_bytes = max_bytes
+        self._run_counts = dict.fromkeys(RunCacheStats._fields, 0)
+        # Part files this session is writing, which evict_runs leaves be
+        self._writing = set()
         if cache:
             self.cache = cache
         else:
@@ -55,7 +160,7 @@ class DQMSession(FuturesSession):
             pass
         return path
 
-    def stream_run(self, series, sample, run, chunk_size=4096):
+    def stream_run(self, series, sample, run, chunk_size=MIN_CHUNK):
         """Stream and cache a run data file.
 
         Returns a generator that yields StreamProg tuples corresponding to the
@@ -63,29 +168,272 @@ class DQMSession(FuturesSession):
         run_path = self._run_path(series, sample, run)
         run_dir = os.path.dirname(run_path)
 
-        if not os.path.exists(run_path):
+        if self._touch_run(run_path):
+            size = os.path.getsize(run_path)
+        else:
             _try_makedirs(run_dir)
 
-            runs = self.fetch_run_list(series, sample)
-            run_info = next(r for r in runs if r.name == run)
+            run_info = self.find_runs(series, sample, [run])[run]
 
             for prog in self._stream_file(
                     run_info.url, run_path, chunk_size=chunk_size):
                 yield prog
 
-        size = os.path.getsize(run_path)
+            size = os.path.getsize(run_path)
+            self._count_fetch(size)
+            self.evict_runs(keep=[run_path])
+
         yield StreamProg(size, size, run_path)
 
+    def fetch_runs(self, series, sample, runs, max_concurrent=MAX_CONCURRENT,
+                   chunk_size=MIN_CHUNK):
+        """Fetch and cache many run data files, max_concurrent at a time.
+
+        Returns a FetchReport of the downloads."""
+        start = time.monotonic()
+        files = []
+        for prog in self.stream_runs(series, sample, runs,
+                                     max_concurrent, chunk_size):
+            if prog.finished:
+                files.append(prog.finished)
+
+        seconds = time.monotonic() - start
+        size = sum(f.size for f in files if f.rate is not None)
+        return FetchReport({f.run: f.path for f in files}, files, size,
+                           seconds, size / seconds if seconds > 0 else None)
+
+    def stream_runs(self, series, sample, runs, max_concurrent=MAX_CONCURRENT,
+                    chunk_size=MIN_CHUNK):
+        """Stream and cache many run data files, max_concurrent at a time.
+
+        Returns a generator that yields RunsProg tuples corresponding to the
+        progress of each download and of all of them. The runs not cached yet
+        are looked up together with find_runs. Runs that fail to download
+        are reported together once the others are done."""
+        runs = list(dict.fromkeys(runs))
+        paths = {run: self._run_path(series, sample, run) for run in runs}
+        cached = [run for run in runs if self._touch_run(paths[run])]
+        to_fetch = [run for run in runs if run not in cached]
+
+        rows = self.find_runs(series, sample, to_fetch) if to_fetch else {}
+
+        files_done = 0
+        bytes_done = 0
+        bytes_total = sum(rows[run].size or 0 for run in to_fetch)
+        for run in cached:
+            files_done += 1
+            size = os.path.getsize(paths[run])
+            yield RunsProg(run, size, size, paths[run], files_done, len(runs),
+                           bytes_done, bytes_total, None,
+                           FileStat(run, paths[run], size, 0.0, None))
+        if not to_fetch:
+            return
+
+        # Downloads run in their own threads, as the session's workers
+        # serve the requests they make, and report back through updates
+        updates = queue.Queue()
+        cancel = threading.Event()
+        start = time.monotonic()
+        failed = {}
+        with ThreadPoolExecutor(max_concurrent) as pool:
+            for run in to_fetch:
+                pool.submit(self._download_run, run, rows[run].url, paths[run],
+                            chunk_size, updates, cancel)
+            try:
+                pending = len(to_fetch)
+                last = {run: None for run in to_fetch}
+                # Bytes of part files that downloads resumed from, which
+                # count as done but not towards the rate
+                resumed = 0
+                while pending:
+                    run, prog, stat, exc = updates.get()
+                    if exc is not None:
+                        pending -= 1
+                        failed[run] = exc
+                        continue
+                    if last[run] is None:
+                        resumed += prog.cur
+                        last[run] = 0
+                    bytes_done += prog.cur - last[run]
+                    last[run] = prog.cur
+                    if stat is not None:
+                        pending -= 1
+                        files_done += 1
+                        self._count_fetch(stat.size)
+                        # Make room, but not by removing runs of this call
+                        self.evict_runs(keep=paths.values())
+                    elapsed = time.monotonic() - start
+                    yield RunsProg(run, prog.cur, prog.total, prog.path,
+                                   files_done, len(runs), bytes_done,
+                                   bytes_total,
+                                   (bytes_done - resumed) / elapsed
+                                   if elapsed > 0 else None,
+                                   stat)
+            finally:
+                # Stop the downloads if the caller stops listening
+                cancel.set()
+
+        if failed:
+            raise error("Failed to fetch runs: {}".format('; '.join(
+                "{}: {}".format(run, exc) for run, exc in failed.items())))
+
+    def _download_run(self, run, url, run_path, chunk_size, updates, cancel):
+        """Download one run file for stream_runs, putting (run, StreamProg,
+        FileStat or None, exception or None) tuples on updates."""
+        if cancel.is_set():
+            return
+        try:
+            _try_makedirs(os.path.dirname(run_path))
+            start = time.monotonic()
+            offset = None
+            dl = self._stream_file(url, run_path, chunk_size=chunk_size)
+            try:
+                for prog in dl:
+                    if cancel.is_set():
+                        return
+                    if offset is None:
+                        offset = prog.cur
+                    updates.put((run, prog, None, None))
+            finally:
+                # Keeps the part file of a cancelled download to resume from
+                dl.close()
+            seconds = time.monotonic() - start
+            stat = FileStat(run, run_path, prog.cur, seconds,
+                            (prog.cur - offset) / seconds
+                            if seconds > 0 else None)
+            updates.put((run, prog, stat, None))
+        except Exception as e:
+            updates.put((run, None, None, e))
+
+    def prefetch_runs(self, series, sample, runs=None, ahead=PREFETCH_AHEAD,
+                      max_rate=None, max_ahead_bytes=None,
+                      chunk_size=MIN_CHUNK):
+        """Yield a PrefetchedRun for each of runs in order, downloading the
+        next runs in the background while the caller works on the current
+        one.
+
+        runs defaults to every run of fetch_run_list, in run order. One
+        thread downloads the runs in order, up to ahead runs past the one
+        last yielded. max_rate caps its download rate, in bytes per second.
+        max_ahead_bytes caps the size of the runs it has downloaded that
+        are not yielded yet, though the run the caller waits for is always
+        fetched. Runs already in the db do not count towards it, and the
+        size of the db as a whole is bounded by the max_bytes of the
+        session. The runs downloaded ahead and the run last yielded are
+        kept from evict_runs. Closing the generator stops the downloads, keeping the
+        part file of the one under way to resume from."""
+        if runs is None:
+            runs = sorted((r.name for r in self.fetch_run_list(series, sample)),
+                          key=int)
+        runs = list(dict.fromkeys(runs))
+        paths = [self._run_path(series, sample, run) for run in runs]
+        rows = self.find_runs(series, sample, [
+            run for run, path in zip(runs, paths) if not os.path.exists(path)])
+
+        cond = threading.Condition()
+        # Index of the run the caller is on, the size of the runs downloaded
+        # by index, and the path or exception of each run done
+        state = {'pos': 0, 'cancel': False}
+        ahead_sizes = {}
+        done = {}
+
+        def wait_turn(i, size):
+            """Wait until run i may be downloaded, return False if
+            cancelled."""
+            with cond:
+                while not state['cancel']:
+                    pos = state['pos']
+                    pending = sum(s for j, s in ahead_sizes.items() if j > pos)
+                    if i <= pos or (i <= pos + ahead and (
+                            max_ahead_bytes is None
+                            or pending + size <= max_ahead_bytes)):
+                        return True
+                    cond.wait()
+                return False
+
+        def download():
+            for i, (run, path) in enumerate(zip(runs, paths)):
+                # Bytes this run adds to the db
+                fetched = 0
+                # Any exception is handed to the caller, which would wait
+                # for the run forever if this thread died instead
+                try:
+                    if not self._touch_run(path):
+                        size = (rows[run].size or 0) if run in rows else 0
+                        if not wait_turn(i, size):
+                            return
+                        if run not in rows:
+                            # Evicted since it was looked for
+                            rows.update(self.find_runs(series, sample, [run]))
+                        _try_makedirs(os.path.dirname(path))
+                        dl = self._stream_file(rows[run].url, path,
+                                               chunk_size=chunk_size)
+                        # The rate is held per run, so that time spent
+                        # waiting for a turn does not allow a burst
+                        start = time.monotonic()
+                        offset = None
+                        try:
+                            for prog in dl:
+                                if state['cancel']:
+                                    return
+                                if offset is None:
+                                    offset = prog.cur
+                                nbytes = prog.cur - offset
+                                if max_rate:
+                                    # Wait off any lead over max_rate
+                                    lead = (nbytes / max_rate
+                                            - (time.monotonic() - start))
+                                    if lead > 0:
+                                        with cond:
+                                            cond.wait_for(
+                                                lambda: state['cancel'], lead)
+                        finally:
+                            dl.close()
+                        self._count_fetch(prog.total)
+                        fetched = prog.total
+                    with cond:
+                        # The run in use and those fetched ahead of it
+                        keep = paths[state['pos']:i + 1]
+                    self.evict_runs(keep=keep)
+                    result = path
+                except Exception as e:
+                    result = e
+                with cond:
+                    ahead_sizes[i] = fetched
+                    done[i] = result
+                    cond.notify_all()
+
+        thread = threading.Thread(target=download, daemon=True)
+        thread.start()
+        try:
+            for i, run in enumerate(runs):
+                start = time.monotonic()
+                with cond:
+                    state['pos'] = i
+                    cond.notify_all()
+                    while i not in done:
+                        cond.wait()
+                result = done.pop(i)
+                if isinstance(result, Exception):
+                    raise error("Failed to fetch run {}: {}".format(
+                        run, result))
+                yield PrefetchedRun(run, result, time.monotonic() - start)
+        finally:
+            with cond:
+                state['cancel'] = True
+                cond.notify_all()
+            thread.join()
+
     def fetch_series_list(self):
         """Return DQMRows corresponding to the series available on DQM Offline."""
-        return _resolve(self._fetch_dqm_rows(DQM_URL)).data
+        return self._fetch_cached_rows('series', DQM_URL)
 
     def fetch_sample_list(self, series):
         """Return DQMRows corresponding to the samples available under the given
         series."""
         series_rows = self.fetch_series_list()
         url = next((r.url for r in series_rows if r.name == series))
-        return _resolve(self._fetch_dqm_rows(url)).data
+        return self._fetch_cached_rows('samples', url)
 
     def fetch_run_list(self, series, sample):
         """Return DQMRows corresponding to the runs available under the given
@@ -94,14 +442,15 @@ class DQMSession(FuturesSession):
         sample_url = next((r.url for r in sample_rows if r.name == sample))
 
         # Get all run directories for this sample
-        macrorun_rows = _resolve(self._fetch_dqm_rows(sample_url)).data
+        macrorun_rows = self._fetch_cached_rows('macroruns', sample_url)
 
-        # Determine which run directories are cached
+        # Determine which run directories are cached. A directory's date
+        # changes when runs are added to it, which gives it a new key
         run_rows = []
         to_req = []
         for mr in macrorun_rows:
-            rows = self._get_cache(mr)
-            if rows:
+            rows = self._get_cache('runs', _dir_key(mr))
+            if rows is not None:
                 run_rows += rows
             else:
                 to_req.append(mr)
@@ -109,79 +458,443 @@ class DQMSession(FuturesSession):
         # Request uncached directories from the servers
         futures = [(mr, self._fetch_dqm_rows(mr.url)) for mr in to_req]
         for mr, fut in futures:
-            rows = _resolve(fut).data
+            rows = _page_rows(_resolve(fut), mr.url)
             run_rows += rows
-            self._write_cache(mr, rows)
+            self._write_cache('runs', _dir_key(mr), rows)
 
+        self._write_index(series, sample, run_rows)
+        self.evict_cache()
         return run_rows
 
-    def _get_cache(self, parent_row):
-        """Return the DQM page corresponding to parent_row as DQMRows if they are
-        cached. Otherwise None."""
-        cache_file = self._cache_path(parent_row)
-        if os.path.exists(cache_file):
+    async def crawl(self, series=None, samples=None,
+                    max_concurrent=CRAWL_CONCURRENT, retries=CRAWL_RETRIES,
+                    timeout=TIMEOUT):
+        """Walk the listing from the series page down to the run pages,
+        yielding the DQMRow of each run as its page arrives.
+
+        An asynchronous generator, to be used as
+
+            async for row in sess.crawl(...):
+
+        series and samples optionally restrict the walk to those names,
+        given as one name or an iterable of them. At most max_concurrent
+        pages are requested at once, each with the given timeout and
+        retried up to retries times on connection errors, timeouts and
+        server errors. Pages are read from and written to the listing cache
+        like fetch_run_list does, and the run index of each sample is
+        rewritten once all its run pages have arrived."""
+        series = _name_set(series)
+        samples = _name_set(samples)
+        sem = asyncio.Semaphore(max_concurrent)
+        found = asyncio.Queue()
+
+        loop = asyncio.get_running_loop()
+
+        async def fetch(level, url, key=None):
+            key = key or url
+            # Cache files are read and written off the event loop, which
+            # would otherwise stall every other request on disk I/O
+            rows = await loop.run_in_executor(
+                None, self._get_cache, level, key)
+            if rows is not None:
+                return rows
+            for attempt in range(retries + 1):
+                try:
+                    # Hold a slot only for the request, not the backoff
+                    async with sem:
+                        res = await asyncio.wrap_future(
+                            self._fetch_dqm_rows(url, timeout=timeout))
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt == retries:
+                        raise error(e)
+                else:
+                    if res.status_code < 500 or attempt == retries:
+                        break
+                await asyncio.sleep(CRAWL_BACKOFF * 2 ** attempt)
+            if not res:
+                raise error("Failed to fetch page {}: {}".format(
+                    url, res.status_code))
+            await loop.run_in_executor(
+                None, self._write_cache, level, key, res.data)
+            return res.data
+
+        async def walk_dir(mr, run_rows):
+            rows = await fetch('runs', mr.url, _dir_key(mr))
+            run_rows += rows
+            found.put_nowait(rows)
+
+        async def walk_sample(series_name, sample_row):
+            macrorun_rows = await fetch('macroruns', sample_row.url)
+            run_rows = []
+            await asyncio.gather(*(walk_dir(mr, run_rows)
+                                   for mr in macrorun_rows))
+            await loop.run_in_executor(
+                None, self._write_index, series_name, sample_row.name,
+                run_rows)
+
+        async def walk_series(series_row):
+            sample_rows = await fetch('samples', series_row.url)
+            await asyncio.gather(*(walk_sample(series_row.name, r)
+                                   for r in sample_rows
+                                   if samples is None or r.name in samples))
+
+        async def walk():
+            series_rows = await fetch('series', DQM_URL)
+            await asyncio.gather(*(walk_series(r) for r in series_rows
+                                   if series is None or r.name in series))
+
+        walker = asyncio.ensure_future(walk())
+        try:
+            while True:
+                get = asyncio.ensure_future(found.get())
+                await asyncio.wait({get, walker},
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if get.done():
+                    for row in get.result():
+                        yield row
+                    continue
+                get.cancel()
+                while not found.empty():
+                    for row in found.get_nowait():
+                        yield row
+                # Raise any error of the walk
+                walker.result()
+                break
+        finally:
+            walker.cancel()
+        self.evict_cache()
+
+    def find_runs(self, series, sample, runs):
+        """Return {run: DQMRow} for the given runs.
+
+        Runs are looked up in the index of the last fetch_run_list, which
+        is refreshed at most once, if some run is missing from it or it is
+        older than the TTL of the run directory listing."""
+        index = self._read_index(series, sample)
+        if any(run not in index for run in runs):
+            index = {r.name: r for r in self.fetch_run_list(series, sample)}
+        missing = [run for run in runs if run not in index]
+        if missing:
+            raise error("Runs not found in {}/{}: {}".format(
+                series, sample, ', '.join(missing)))
+        return {run: index[run] for run in runs}
+
+    def evict_cache(self):
+        """Remove cached pages older than the TTL of their level, and cache
+        files named by the process-dependent hash() of earlier versions."""
+        now = time.time()
+        for level, ttl in CACHE_TTL.items():
+            level_dir = os.path.join(self.cache, level)
+            if not os.path.isdir(level_dir):
+                continue
+            for entry in os.scandir(level_dir):
+                try:
+                    if now - entry.stat().st_mtime > ttl:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+        if os.path.isdir(self.cache):
+            for entry in os.scandir(self.cache):
+                if entry.name.isdigit() and entry.is_file():
+                    os.remove(entry.path)
+
+    def evict_runs(self, keep=()):
+        """Remove the least recently used run files until those in the db
+        fit in max_bytes. Pinned runs and the paths in keep are never
+        removed, though their size counts towards the budget.
+
+        Part files left by interrupted downloads count towards the budget
+        too, and are removed along with their validators in the same
+        order, by the last time they were written. Those of pinned and
+        kept runs and those this session is writing stay.
+
+        Returns the number of bytes removed."""
+        if self.max_bytes is None:
+            return 0
+        keep = {os.path.abspath(p) for p in keep}
+        keep.update(os.path.abspath(self._run_path(*pin))
+                    for pin in self.pinned_runs())
+
+        total = 0
+        entries = []
+        for path, st in _run_files(self.db):
+            total += st.st_size
+            path = os.path.abspath(path)
+            is_part = path.endswith(PART_EXT)
+            if is_part and path in self._writing:
+                continue
+            if (path[:-len(PART_EXT)] if is_part else path) not in keep:
+                entries.append((st.st_mtime, st.st_size, path, is_part))
+
+        removed = 0
+        for _, size, path, is_part in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                # Owned by another user of a shared db, so it stays
+                continue
+            else:
+                if is_part:
+                    _remove(path + VALIDATOR_EXT)
+                    self._run_counts['parts_evicted'] += 1
+                    self._run_counts['bytes_parts_evicted'] += size
+                else:
+                    self._run_counts['evicted'] += 1
+                    self._run_counts['bytes_evicted'] += size
+                removed += size
+            total -= size
+        return removed
+
+    def pin_run(self, series, sample, run):
+        """Exempt a run file, such as that of a reference run, from
+        eviction. Pins are kept in the db, so they hold for every session
+        sharing it."""
+        self._edit_pins(lambda pins: pins.add((series, sample, str(run))))
+
+    def unpin_run(self, series, sample, run):
+        """Let a pinned run file be evicted again."""
+        self._edit_pins(lambda pins: pins.discard((series, sample, str(run))))
+
+    def pinned_runs(self):
+        """Return the set of (series, sample, run) pinned in the db."""
+        try:
+            with open(os.path.join(self.db, PINS_PATH)) as f:
+                return {tuple(pin) for pin in json.load(f)}
+        except (OSError, ValueError):
+            return set()
+
+    def run_cache_stats(self):
+        """Return the RunCacheStats of the session so far."""
+        return RunCacheStats(**self._run_counts)
+
+    def _edit_pins(self, edit):
+        """Apply edit to the set of pins in the db and write it back."""
+        _try_makedirs(self.db)
+        # Sessions take turns, so that none writes back pins read before
+        # another's change and drops it
+        with open(os.path.join(self.db, '.' + PINS_PATH + '.lock'),
+                  'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            pins = self.pinned_runs()
+            edit(pins)
+            _write_json(os.path.join(self.db, PINS_PATH), sorted(pins))
+
+    def _touch_run(self, run_path):
+        """Return whether run_path is in the db, and if so mark it as used
+        now and count it as a hit."""
+        try:
+            os.utime(run_path)
+            size = os.path.getsize(run_path)
+        except (FileNotFoundError, PermissionError):
+            # A run file another user owns counts as missing, and is
+            # downloaded again rather than used unmarked
+            return False
+        self._run_counts['hits'] += 1
+        self._run_counts['bytes_saved'] += size
+        return True
+
+    def _count_fetch(self, size):
+        self._run_counts['misses'] += 1
+        self._run_counts['bytes_fetched'] += size
+
+    def _fetch_cached_rows(self, level, url):
+        """Return the DQMRows of the page at url, from the cache if they were
+        fetched within the TTL of level."""
+        rows = self._get_cache(level, url)
+        if rows is None:
+            rows = _page_rows(_resolve(self._fetch_dqm_rows(url)), url)
+            self._write_cache(level, url, rows)
+        return rows
+
+    def _get_cache(self, level, key):
+        """Return the DQMRows cached under level and key if they are younger
+        than the TTL of level. Otherwise None."""
+        cache_file = self._cache_path(level, key)
+        try:
+            if time.time() - os.path.getmtime(cache_file) > CACHE_TTL[level]:
+                return None
             with open(cache_file) as f:
                 dat = json.load(f)
-                return [DQMRow(*r) for r in dat]
-        else:
+        except (OSError, ValueError):
             return None
+        return [DQMRow(*r) for r in dat]
+
+    def _write_cache(self, level, key, dqm_rows):
+        """Write a list of DQMRows to the cache under level and key."""
+        _write_json(self._cache_path(level, key), dqm_rows)
+
+    def _cache_path(self, level, key):
+        """Return the path to the cached DQM page of level under key."""
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.cache, level, digest + '.json')
+
+    def _read_index(self, series, sample):
+        """Return the run index of series and sample as {run: DQMRow}, or
+        an empty one if it is older than the TTL of the listing it was
+        built from."""
+        index_file = self._index_path(series, sample)
+        try:
+            if (time.time() - os.path.getmtime(index_file)
+                    > CACHE_TTL['macroruns']):
+                return {}
+            with open(index_file) as f:
+                dat = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {run: DQMRow(*r) for run, r in dat.items()}
 
-    def _write_cache(self, parent_row, dqm_rows):
-        """Write a list of DQMRows to the cache under their parent_row."""
-        cache_file = self._cache_path(parent_row)
-        _try_makedirs(os.path.dirname(cache_file))
-        with open(cache_file, 'w') as f:
-            json.dump(dqm_rows, f)
+    def _write_index(self, series, sample, run_rows):
+        """Write the run index of series and sample from its run rows."""
+        _write_json(self._index_path(series, sample),
+                    {r.name: r for r in run_rows})
 
-    def _cache_path(self, parent_row):
-        """Return the path to a cached DQM page specified by its parent DQMRow."""
-        return os.path.join(self.cache, str(abs(hash(parent_row))))
+    def _index_path(self, series, sample):
+        """Return the path to the run index of series and sample."""
+        return os.path.join(self.cache, INDEX_DIR, series, sample + '.json')
 
     def _fetch_dqm_rows(self, url, timeout=TIMEOUT):
         """Return a future of DQMRows of a DQM page at url.
 
-        Access the array of DQMRows at _resolve(self._fetch_dqm_rows(...)).data"""
+        Access the array of DQMRows at _resolve(self._fetch_dqm_rows(...)).data,
+        which is None if the request failed."""
 
-        # Callback to process dqm responses
+        # Callback to process dqm responses, leaving error pages unparsed
         def cb(sess, resp):
-            resp.data = _parse_dqm_page(resp.text)
+            resp.data = _parse_dqm_page(resp.text) if resp.ok else None
 
         return self.get(url, timeout=timeout, background_callback=cb)
 
-    def _stream_file(self, url, dest, chunk_size=4096):
+    def _stream_file(self, url, dest, chunk_size=MIN_CHUNK):
         """Stream a file into a destination path.
 
+        The file is written to dest + PART_EXT and only renamed to dest once
+        its size matches the one announced by the server, so dest is always
+        complete. A part file left by an interrupted download is resumed
+        with a Range request, made conditional with If-Range on the
+        validator stored next to it, so that a file changed on the server
+        since is downloaded again whole. Part files without a validator are
+        not resumed. Reads start at chunk_size bytes and adapt between
+        MIN_CHUNK and MAX_CHUNK to take about CHUNK_SECONDS each.
+
         Returns a generator of StreamProg tuples to indicate download progress."""
-        res = _resolve(self.get(url, stream=True))
+        part = dest + PART_EXT
+        validator_path = part + VALIDATOR_EXT
+        writing = os.path.abspath(part)
+        self._writing.add(writing)
+        try:
+            yield from self._stream_part(url, dest, part, validator_path,
+                                         chunk_size)
+        finally:
+            self._writing.discard(writing)
+
+    def _stream_part(self, url, dest, part, validator_path, chunk_size):
+        """Download url through the part file part into dest, for
+        _stream_file."""
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        validator = _read_validator(validator_path) if offset else None
+        if validator is None:
+            offset = 0
+        res = self._get_from(url, offset, validator)
+
+        if res.status_code == 416:
+            # The part file is complete, or the server does not know the
+            # size of the file
+            total = _content_range_total(res)
+            res.close()
+            if total == offset:
+                os.replace(part, dest)
+                _remove(validator_path)
+                yield StreamProg(total, total, dest)
+                return
+            offset = 0
+            res = self._get_from(url, offset)
+
         if not res:
             raise error("Failed to download file: {}".format(url))
+        if res.status_code == 206:
+            total = _content_range_total(res)
+        else:
+            # The server ignored the range, or the file changed since the
+            # part file was written, and sends the whole file
+            offset = 0
+            total = res.headers.get('content-length')
+        if total is None:
+            res.close()
+            raise error("Failed to download file: Unknown size: {}".format(url))
+        total = int(total)
 
-        total = int(res.headers.get('content-length'))
-        cur = 0
-        try:
-            with open(dest, 'wb') as f:
+        if not offset:
+            # Empty the part file before recording the version it holds, so
+            # that it is never resumed against the validator of another
+            _remove(validator_path)
+            open(part, 'wb').close()
+            validator = _response_validator(res)
+            if validator is not None:
+                _write_json(validator_path, validator)
+
+        cur = offset
+        with res, open(part, 'ab') as f:
+            yield StreamProg(cur, total, dest)
+            while cur < total:
+                start = time.monotonic()
+                try:
+                    data = res.raw.read(min(chunk_size, total - cur),
+                                        decode_content=True)
+                except urllib3.exceptions.HTTPError as e:
+                    raise error("Failed to stream file: {}".format(e))
+                if not data:
+                    break
+                f.write(data)
+                cur += len(data)
+                chunk_size = _adapt_chunk(chunk_size, len(data),
+                                          time.monotonic() - start)
                 yield StreamProg(cur, total, dest)
-                for data in res.iter_content(chunk_size=chunk_size):
-                    cur += len(data)
-                    f.write(data)
-                    yield StreamProg(cur, total, dest)
-            if cur != total:
-                raise error(
-                    "Failed to stream file: Final size {} less than total {}"
-                    .format(cur, total))
-        except:
-            # Remove the file if anything went wrong in the middle
-            os.remove(dest)
-            raise
+            f.flush()
+            os.fsync(f.fileno())
+
+        # The part file stays behind to resume from
+        if cur != total:
+            raise error(
+                "Failed to stream file: Final size {} less than total {}"
+                .format(cur, total))
+        os.replace(part, dest)
+        _remove(validator_path)
+
+    def _get_from(self, url, offset, validator=None):
+        """Return the streamed response to a request for url from byte offset
+        onwards, or for the whole file if it no longer matches validator."""
+        # Byte offsets only line up with the file if it is sent unencoded
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            if validator is not None:
+                headers['If-Range'] = validator
+        return _resolve(self.get(url, stream=True, headers=headers))
 
     def _run_path(self, series, sample, run):
         """Return the path to the specified run data file in the cached db."""
         return "{}/{}.root".format(os.path.join(self.db, series, sample), run)
 
 
-def _parse_dqm_page(content):
+def _parse_dqm_page(content, parser=PAGE_PARSER):
     """Return the contents of a DQM series, sample, or macrorun page as a list
-    of DQMRows."""
+    of DQMRows, using the 'fast' or the 'lxml' parser."""
+    if parser == 'lxml':
+        return _parse_dqm_page_lxml(content)
+    try:
+        return list(_iter_dqm_rows((content,)))
+    except _Unparsed:
+        # A row the fast parser does not know, let lxml make sense of it
+        return _parse_dqm_page_lxml(content)
+
+
+def _parse_dqm_page_lxml(content):
+    """Return the DQMRows of a page, from its lxml document tree."""
     dqm_rows = []
     tree = lxml.html.fromstring(content)
     tree.make_links_absolute(BASE_URL)
@@ -189,16 +902,66 @@ def _parse_dqm_page(content):
     for tr in tree.xpath('//tr'):
         td_strs = tr.xpath('td//text()')
         td_urls = tr.xpath('td/a/@href')
+        dqm_rows.append(
+            _dqm_row(td_urls[0], td_strs[0], td_strs[1], td_strs[2]))
 
-        full_name = td_strs[0]
-        url = td_urls[0]
-        size = int(td_strs[1]) if td_strs[1] != '-' else None
-        date = td_strs[2]
-        name = _parse_run_full_name(full_name) if size else full_name[:-1]
+    return dqm_rows
 
-        dqm_rows.append(DQMRow(name, full_name, url, size, date))
 
-    return dqm_rows
+def _iter_dqm_rows(chunks):
+    """Yield the DQMRows of a page given as an iterable of text chunks, as
+    soon as the chunks holding each row are in.
+
+    Only the fixed row layout of the DQM listing, a link followed by a size
+    and a date cell, is matched, so the page is scanned with one regular
+    expression instead of being built into a tree. Raises _Unparsed on a
+    row of any other layout."""
+    buf = ''
+    for chunk in chunks:
+        buf += chunk
+        # Parse up to the end of the last complete row, keep the rest
+        end = buf.rfind('</tr>')
+        if end < 0:
+            continue
+        end += len('</tr>')
+        yield from _scan_rows(buf, end)
+        buf = buf[end:]
+    yield from _scan_rows(buf, len(buf))
+
+
+def _scan_rows(text, end):
+    """Yield the DQMRows of the rows in text[:end]."""
+    nrows = 0
+    for m in _ROW_RE.finditer(text, 0, end):
+        nrows += 1
+        href, full_name, size, date = map(html.unescape, m.groups())
+        url = _absolute_url(href.strip())
+        yield _dqm_row(url, full_name, size, date)
+    if nrows != len(_TR_RE.findall(text, 0, end)):
+        raise _Unparsed()
+
+
+def _absolute_url(href):
+    """Return href resolved against BASE_URL, as lxml's make_links_absolute
+    does, joining each directory of a page only once."""
+    # Only plain paths from the root of the server, like DQM's links
+    if (not href.startswith('/') or href.startswith('//') or '/.' in href
+            or not _URL_SPECIAL.isdisjoint(href)):
+        return urljoin(BASE_URL, href)
+    head, sep, tail = href.rpartition('/')
+    return _join_dir(BASE_URL, head + sep) + tail
+
+
+@functools.lru_cache(maxsize=256)
+def _join_dir(base, dirname):
+    return urljoin(base, dirname)
+
+
+def _dqm_row(url, full_name, size, date):
+    """Return the DQMRow of a row given the text of its cells."""
+    size = int(size) if size != '-' else None
+    name = _parse_run_full_name(full_name) if size else full_name[:-1]
+    return DQMRow(name, full_name, url, size, date)
 
 
 def _parse_run_full_name(full_name):
@@ -212,6 +975,41 @@ def _parse_run_full_name(full_name):
     return str(int(name))
 
 
+def _content_range_total(res):
+    """Return the total size in the Content-Range header of a response, or
+    None if it is missing or unknown."""
+    total = res.headers.get('content-range', '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+
+def _response_validator(res):
+    """Return the validator of the file a response sends to resume it with
+    If-Range: its strong ETag, else its Last-Modified date, else None."""
+    etag = res.headers.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return res.headers.get('last-modified')
+
+
+def _read_validator(path):
+    """Return the validator stored at path, or None."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _adapt_chunk(chunk_size, nread, seconds):
+    """Return the next read size of a download, after a read of nread bytes
+    with chunk_size asked for took seconds."""
+    if nread == chunk_size and seconds < CHUNK_SECONDS / 2:
+        return min(chunk_size * 2, MAX_CHUNK)
+    if seconds > CHUNK_SECONDS * 2:
+        return max(chunk_size // 2, MIN_CHUNK)
+    return chunk_size
+
+
 def _get_cern_ca(path):
     """Download the CERN ROOT CA to the specified path."""
     _try_makedirs(os.path.dirname(path))
@@ -222,6 +1020,74 @@ def _get_cern_ca(path):
         f.write(b'\n-----END CERTIFICATE-----\n')
 
 
+def _run_files(db):
+    """Yield (path, stat) of the run files in db, which sit at
+    db/series/sample/run.root, and of the part files of their downloads."""
+    for series in _scandirs(db):
+        for sample in _scandirs(series.path):
+            for entry in os.scandir(sample.path):
+                if not entry.name.endswith(('.root', '.root' + PART_EXT)):
+                    continue
+                try:
+                    yield entry.path, entry.stat()
+                except FileNotFoundError:
+                    pass
+
+
+def _scandirs(path):
+    """Return the directory entries of the subdirectories of path."""
+    try:
+        return [e for e in os.scandir(path) if e.is_dir()]
+    except FileNotFoundError:
+        return []
+
+
+def _page_rows(res, url):
+    """Return the DQMRows of a response of _fetch_dqm_rows, raising on a
+    failed request."""
+    if not res:
+        raise error("Failed to fetch page {}: {}".format(url, res.status_code))
+    return res.data
+
+
+def _name_set(names):
+    """Return a set of series or sample names given as one name or an
+    iterable of them, or None for None."""
+    if names is None:
+        return None
+    if isinstance(names, str):
+        return {names}
+    return set(names)
+
+
+def _dir_key(row):
+    """Return the cache key of the page of a run directory DQMRow."""
+    return '{} {}'.format(row.url, row.date)
+
+
+def _write_json(path, obj):
+    """Atomically write obj as json to path."""
+    _try_makedirs(os.path.dirname(path))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            # One write of the whole document is much faster than dump's
+            # many small ones
+            f.write(json.dumps(obj))
+        os.replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def _remove(path):
+    """Remove a file if it exists"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
 def _try_makedirs(*args, **kwargs):
     """Make a directory if it doesn't exist"""
     try:
@@ -241,5 +1107,10 @@ def _resolve(future):
         raise error(e)
 
 
+class _Unparsed(Exception):
+    """A DQM page has rows the fast parser does not handle."""
+    pass
+
+
 class error(Exception):
     pass
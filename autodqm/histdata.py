@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Conversions between ROOT histograms and NumPy arrays.
+
+HistData is a compact, picklable copy of a TH1/TH2 that carries everything
+needed to rebuild it, so histograms can cross process boundaries without
+pickling ROOT objects. ROOT is only imported where a histogram is rebuilt.
+
+BinViews are the other way around: NumPy views onto the buffers of a live
+histogram, for reading or writing its bins without a copy.
+"""
+
+from collections import namedtuple
+import numpy as np
+
+AxisData = namedtuple('AxisData', ('title', 'edges', 'labels'))
+
+
+class HistData(namedtuple('HistData', (
+        'name', 'title', 'class_name', 'axes', 'contents', 'sumw2',
+        'entries', 'stats', 'profile'))):
+    """Data class for a histogram's binning and bin arrays.
+
+    contents and sumw2 include under- and overflow and are indexed [x] or
+    [x, y], like bin_arrays. sumw2 is None for histograms that do not
+    store it, and stats is None when ROOT should recompute the statistics
+    from the contents. For profiles, contents and sumw2 are those of the projection
+    and profile holds the raw arrays needed to rebuild the profile itself.
+    """
+    __slots__ = ()
+
+    @property
+    def errors(self):
+        if self.sumw2 is None:
+            return np.sqrt(np.abs(self.contents))
+        return np.sqrt(self.sumw2)
+
+    @property
+    def dimension(self):
+        return len(self.axes)
+
+
+class BinViews(namedtuple('BinViews', (
+        'contents', 'sumw2', 'edges', 'hist'))):
+    """Views onto the bin buffers of a histogram, made by bin_views.
+
+    contents and sumw2 are indexed [x] or [x, y] like bin_arrays, in the
+    type the histogram stores them in, and sumw2 is None if it stores none.
+    edges holds the bin edges of each axis. hist is the histogram viewed,
+    the projection for profiles, and must outlive the views.
+    """
+    __slots__ = ()
+
+    @property
+    def errors(self):
+        """The bin errors as a new float64 array."""
+        if self.sumw2 is None:
+            return np.sqrt(np.abs(self.contents), dtype=np.float64)
+        return np.sqrt(self.sumw2)
+
+
+def bin_views(hist, flow=True):
+    """Return the BinViews of a TH1/TH2, without copying its buffers.
+
+    With flow False the views leave out the under- and overflow bins, and
+    are then not contiguous. Profiles are viewed through their projection
+    so that contents and errors match GetBinContent and GetBinError; writes
+    to those views do not reach the profile. The edges of variable binnings
+    view the axis buffers, those of uniform ones are computed.
+    """
+    proj = _projection(hist)
+    contents = _contents(proj)
+    sumw2 = None
+    if proj.GetSumw2N():
+        sumw2 = _cells(proj, proj.GetSumw2().GetArray())
+    if not flow:
+        inner = (slice(1, -1),) * contents.ndim
+        contents = contents[inner]
+        if sumw2 is not None:
+            sumw2 = sumw2[inner]
+    edges = tuple(_edges(ax, copy=False) for ax in _axes(hist))
+    return BinViews(contents, sumw2, edges, proj)
+
+
+def bin_arrays(hist):
+    """Return the bin contents and errors of a TH1/TH2, under- and overflow
+    included, as float64 arrays indexed [x] or [x, y].
+
+    Profiles are read through their projection so that contents and errors
+    match GetBinContent and GetBinError.
+    """
+    views = bin_views(hist)
+    return views.contents.astype(np.float64), views.errors
+
+
+def set_bin_arrays(hist, vals, errs=None):
+    """Write arrays shaped like those of bin_arrays back into hist in one
+    call each, keeping its number of entries."""
+    entries = hist.GetEntries()
+    hist.SetContent(np.ascontiguousarray(vals.T, dtype=np.float64).ravel())
+    if errs is not None:
+        hist.SetError(np.ascontiguousarray(errs.T, dtype=np.float64).ravel())
+    hist.SetEntries(entries)
+
+
+def from_hist(hist):
+    """Return a HistData copy of a TH1/TH2."""
+    axes = axis_data(hist)
+
+    profile = None
+    if hist.InheritsFrom('TProfile') or hist.InheritsFrom('TProfile2D'):
+        # Held until its contents are copied, as it is freed with it
+        entries_proj = _projection(hist, "B")
+        profile = {
+            'sumwy': _contents(hist).copy(),
+            'sumwy2': _cells(hist, hist.GetSumw2().GetArray()).copy(),
+            'binentries': _contents(entries_proj).copy(),
+            'binsumw2': None,
+            'erroroption': hist.GetErrorOption(),
+        }
+        if hist.GetBinSumw2().GetSize():
+            profile['binsumw2'] = _cells(
+                hist, hist.GetBinSumw2().GetArray()).copy()
+
+    views = bin_views(hist)
+    contents = views.contents.astype(np.float64)
+    sumw2 = None if views.sumw2 is None else views.sumw2.copy()
+
+    stats = np.zeros(_NSTATS)
+    hist.GetStats(stats)
+
+    return HistData(hist.GetName(), hist.GetTitle(), hist.ClassName(), axes,
+                    contents, sumw2, hist.GetEntries(), stats, profile)
+
+
+def project_profile(profile):
+    """Return the contents and sumw2 of the projection of a profile from
+    the raw arrays in HistData.profile, as ProjectionX(Y) with option "e"
+    and TProfile::GetBinError would compute them."""
+    sumw = profile['binentries']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(sumw != 0, profile['sumwy'] / sumw, 0)
+        if profile['binsumw2'] is not None:
+            neff = np.square(sumw) / profile['binsumw2']
+        else:
+            neff = sumw
+        spread = np.sqrt(np.abs(profile['sumwy2'] / sumw - np.square(mean)))
+
+        option = profile['erroroption']
+        if option == 'g':
+            err = 1 / np.sqrt(sumw)
+        elif option == 'i':
+            err = np.where(spread != 0, spread, 1 / np.sqrt(12)) / np.sqrt(neff)
+        elif option == 's':
+            err = spread
+        else:
+            err = spread / np.sqrt(neff)
+    err = np.where(sumw != 0, err, 0)
+    return mean, np.square(err)
+
+
+def update_digest(h, hd):
+    """Feed the class, binning and bin arrays of a HistData into the
+    hashlib object h."""
+    h.update(hd.class_name.encode())
+    for ax in hd.axes:
+        h.update(np.ascontiguousarray(ax.edges, np.float64).tobytes())
+    arrays = [hd.contents, hd.sumw2, np.float64(hd.entries)]
+    if hd.profile:
+        arrays += [hd.profile[k] for k in sorted(hd.profile)
+                   if k != 'erroroption']
+    for arr in arrays:
+        if arr is not None:
+            h.update(np.ascontiguousarray(arr, np.float64).tobytes())
+
+
+def axis_data(hist):
+    """Return the AxisData of each axis of a TH1/TH2."""
+    return tuple(AxisData(ax.GetTitle(), _edges(ax), _labels(ax))
+                 for ax in _axes(hist))
+
+
+def to_hist(hd):
+    """Rebuild a detached ROOT histogram from a HistData."""
+    import ROOT
+
+    args = [hd.name, hd.title]
+    for ax in hd.axes:
+        args += [len(ax.edges) - 1, np.ascontiguousarray(ax.edges, np.float64)]
+
+    add_dir = ROOT.TH1.AddDirectoryStatus()
+    ROOT.TH1.AddDirectory(False)
+    try:
+        hist = getattr(ROOT, hd.class_name)(*args)
+    finally:
+        ROOT.TH1.AddDirectory(add_dir)
+
+    for root_ax, ax in zip((hist.GetXaxis(), hist.GetYaxis()), hd.axes):
+        root_ax.SetTitle(ax.title)
+        for i, label in enumerate(ax.labels or (), 1):
+            if label:
+                root_ax.SetBinLabel(i, label)
+
+    if hd.profile:
+        prof = hd.profile
+        hist.SetErrorOption(prof['erroroption'])
+        # TProfiles offer no bulk setter for their bin entries, and setting
+        # them overwrites the bin sums of squared weights written below
+        flat = prof['binentries'].T.ravel()
+        for b in np.flatnonzero(flat):
+            hist.SetBinEntries(int(b), flat[b])
+        if prof['binsumw2'] is not None:
+            hist.Sumw2()
+            _cells(hist, hist.GetBinSumw2().GetArray())[...] = prof['binsumw2']
+        _contents(hist)[...] = prof['sumwy']
+        _cells(hist, hist.GetSumw2().GetArray())[...] = prof['sumwy2']
+    else:
+        _contents(hist)[...] = hd.contents
+        if hd.sumw2 is not None:
+            hist.Sumw2()
+            _cells(hist, hist.GetSumw2().GetArray())[...] = hd.sumw2
+
+    hist.SetEntries(hd.entries)
+    if hd.stats is not None:
+        hist.PutStats(np.array(hd.stats, dtype=np.float64))
+    return hist
+
+
+def _projection(hist, option="e"):
+    """Return the projection of a profile, detached from gDirectory, or hist
+    itself otherwise."""
+    if hist.InheritsFrom('TProfile'):
+        proj = hist.ProjectionX(hist.GetName() + "_px_" + option, option)
+    elif hist.InheritsFrom('TProfile2D'):
+        proj = hist.ProjectionXY(hist.GetName() + "_pxy_" + option, option)
+    else:
+        return hist
+    import ROOT
+    proj.SetDirectory(0)
+    ROOT.SetOwnership(proj, True)
+    return proj
+
+
+def _contents(hist):
+    """Return a writable view of the bin contents buffer of hist."""
+    for base, dtype in _ARRAY_TYPES:
+        if hist.InheritsFrom(base):
+            return _cells(hist, hist.GetArray(), dtype)
+    raise error("Unsupported histogram class {}".format(hist.ClassName()))
+
+
+def _cells(hist, ptr, dtype=np.float64):
+    """Return a writable view of a per-cell buffer of hist, indexed like
+    bin_arrays."""
+    shape = tuple(n + 2 for n in (hist.GetNbinsY(), hist.GetNbinsX())
+                  [2 - hist.GetDimension():])
+    view = np.frombuffer(ptr, dtype=dtype, count=hist.GetNcells())
+    # ROOT stores bins with x varying fastest
+    return view.reshape(shape).T
+
+
+def _axes(hist):
+    """Return the TAxis of each dimension of a TH1/TH2."""
+    return (hist.GetXaxis(), hist.GetYaxis())[:hist.GetDimension()]
+
+
+def _edges(axis, copy=True):
+    """Return the bin edges of a TAxis, as a view of its buffer unless copy
+    is set."""
+    xbins = axis.GetXbins()
+    if xbins.GetSize():
+        edges = np.frombuffer(xbins.GetArray(), dtype=np.float64,
+                              count=xbins.GetSize())
+        return edges.copy() if copy else edges
+    return np.linspace(axis.GetXmin(), axis.GetXmax(), axis.GetNbins() + 1)
+
+
+def _labels(axis):
+    """Return the bin labels of a TAxis, or None if it has none."""
+    if not axis.GetLabels():
+        return None
+    return [axis.GetBinLabel(i) for i in range(1, axis.GetNbins() + 1)]
+
+
+# Length of the array filled by TH1::GetStats, large enough for any class
+_NSTATS = 13
+
+# Element types of the content buffers, keyed by the TArray the histogram
+# class inherits from
+_ARRAY_TYPES = (
+    ('TArrayD', np.float64),
+    ('TArrayF', np.float32),
+    ('TArrayI', np.int32),
+    ('TArrayS', np.int16),
+    ('TArrayC', np.int8),
+    ('TArrayL64', np.int64),
+)
+
+
+class error(Exception):
+    pass
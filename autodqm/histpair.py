@@ -1,41 +1,94 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from collections import namedtuple
+import hashlib
 import json
 
+from histdata import bin_arrays
+
+# What the comparators derive from a ref histogram alone. vals and errs are
+# read-only bin_arrays of ref_hist; row_sums holds the sum of the in-range
+# bins of each y row of a TH2 and is None for a TH1.
+RefPrep = namedtuple('RefPrep', ('vals', 'errs', 'sumw', 'entries',
+                                 'row_sums'))
+
 
 class HistPair(object):
-    """Data class for storing data and ref histograms to be compared by AutoDQM, as well as any relevant configuration parameters."""
+    """Data class for storing data and ref histograms to be compared by AutoDQM, as well as any relevant configuration parameters.
+
+    Either histogram may be given as None together with a data_loader or
+    ref_loader, a function of no arguments that returns it, to have it read
+    only when it is first used. The names and config of a pair are not to
+    be changed once it is made, as its digest is computed once.
+    """
+
+    __slots__ = ('data_series', 'data_sample', 'data_run', 'data_name',
+                 '_data_hist', '_data_loader',
+                 'ref_series', 'ref_sample', 'ref_run', 'ref_name',
+                 '_ref_hist', '_ref_loader', '_ref_prep',
+                 'config', 'comparators', '_keystr', '_digest')
 
     def __init__(self, config,
                  data_series, data_sample, data_run, data_name, data_hist,
-                 ref_series, ref_sample, ref_run, ref_name, ref_hist):
+                 ref_series, ref_sample, ref_run, ref_name, ref_hist,
+                 ref_prep=None, data_loader=None, ref_loader=None):
 
         self.data_series = data_series
         self.data_sample = data_sample
         self.data_run = data_run
         self.data_name = data_name
-        self.data_hist = data_hist
+        self._data_hist = data_hist
+        self._data_loader = data_loader
 
         self.ref_series = ref_series
         self.ref_sample = ref_sample
         self.ref_run = ref_run
         self.ref_name = ref_name
-        self.ref_hist = ref_hist
+        self._ref_hist = ref_hist
+        self._ref_loader = ref_loader
+        self._ref_prep = ref_prep
 
         self.config = config
         self.comparators = config.get(
             'comparators', ('pull_values', 'ks_test'))
+        self._keystr = None
+        self._digest = None
+
+    @property
+    def data_hist(self):
+        if self._data_hist is None and self._data_loader is not None:
+            self._data_hist = self._data_loader()
+            self._data_loader = None
+        return self._data_hist
+
+    @property
+    def ref_hist(self):
+        if self._ref_hist is None and self._ref_loader is not None:
+            self._ref_hist = self._ref_loader()
+            self._ref_loader = None
+        return self._ref_hist
+
+    @property
+    def ref_prep(self):
+        """The RefPrep of ref_hist, computed on first use unless it was
+        passed in already, e.g. by a RefSession."""
+        if self._ref_prep is None:
+            self._ref_prep = prepare_ref(self.ref_hist)
+        return self._ref_prep
+
+    def load(self):
+        """Read both histograms now, e.g. before the file they are read
+        from is closed."""
+        self.data_hist
+        self.ref_hist
 
     def __eq__(self, other):
         return (isinstance(other, type(self))
-                and self.data_name == other.data_name
-                and self.ref_name == other.ref_name
-                and self.query == other.config
-                and self.config == other.config
+                and self._key() == other._key()
                 and self.comparators == other.comparators)
 
-    def __neq__(self, other):
+    def __ne__(self, other):
         return not self == other
 
     def __hash__(self):
@@ -43,7 +96,33 @@ class HistPair(object):
         #     self.data_series + self.data_sample + self.data_run + self.data_name +
         #     self.ref_series + self.ref_sample + self.ref_run + self.ref_name +
         #     json.dumps(self.config, sort_keys=True))
-        return hash(
-            str(self.data_series) + str(self.data_sample) + str(self.data_run) + str(self.data_name) +
-            str(self.ref_series) + str(self.ref_sample) + str(self.ref_run) + str(self.ref_name) +
-            json.dumps(self.config, sort_keys=True))
+        return hash(self._key())
+
+    def digest(self):
+        """Return a hex digest of the pair's names and config that, unlike
+        hash(), is the same in every process."""
+        if self._digest is None:
+            self._digest = hashlib.sha1(self._key().encode()).hexdigest()
+        return self._digest
+
+    def _key(self):
+        if self._keystr is None:
+            self._keystr = (
+                str(self.data_series) + str(self.data_sample) + str(self.data_run) + str(self.data_name) +
+                str(self.ref_series) + str(self.ref_sample) + str(self.ref_run) + str(self.ref_name) +
+                json.dumps(self.config, sort_keys=True))
+        return self._keystr
+
+
+def prepare_ref(ref_hist):
+    """Return the RefPrep of a ref histogram."""
+    vals, errs = bin_arrays(ref_hist)
+    row_sums = None
+    if ref_hist.GetDimension() == 2:
+        row_sums = vals[1:-1, 1:-1].sum(axis=0)
+        row_sums.flags.writeable = False
+    # The arrays may be shared by every pair a RefSession binds
+    vals.flags.writeable = False
+    errs.flags.writeable = False
+    return RefPrep(vals, errs, ref_hist.GetSumOfWeights(),
+                   ref_hist.GetEntries(), row_sums)
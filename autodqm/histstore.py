@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Columnar on-disk store of the configured histograms of DQM runs.
+
+Each run of a subsystem is a directory holding an index.json and one .npy
+file per column.
+A column is the flat float64 concatenation of one array of every histogram
+in the run (bin contents, sumw2, axis edges, ...), and the index records
+each histogram's metadata and the offset and shape of its arrays within
+the columns. Reading a run memory-maps the columns and returns HistData
+views into them, so it needs neither ROOT nor a pass over the bins.
+
+    <store_dir>/<subsystem>/<run>/index.json
+    <store_dir>/<subsystem>/<run>/contents.npy
+    <store_dir>/<subsystem>/<run>/sumw2.npy
+    <store_dir>/<subsystem>/<run>/edges.npy
+    ...
+
+Entries written without a subsystem, such as merged references, are
+<store_dir>/<run>. An entry is a symlink to a hidden directory of the
+files, so that writing a run again swaps the new files in atomically:
+readers see either the old or the new entry, never none.
+
+Histograms are keyed by their path below the subsystem's main_gdir, which
+does not depend on the run number, e.g. "CSCInput/cscLCTStrip".
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+import cfg
+from histdata import AxisData, HistData
+
+INDEX_NAME = 'index.json'
+STORE_VERSION = 1
+
+# Keys of HistData.profile stored as columns rather than in the index
+_PROFILE_COLUMNS = ('sumwy', 'sumwy2', 'binentries', 'binsumw2')
+
+
+def convert(config_dir, subsystem, run, root_path, store_dir):
+    """Extract the histograms configured for subsystem from the DQM ROOT
+    file of run into store_dir, and return their paths."""
+    import ROOT
+    import histdata
+    import keyindex
+
+    config = cfg.get_subsystem(config_dir, subsystem)
+    main_gdir = config["main_gdir"].format(run)
+
+    tfile = ROOT.TFile.Open(root_path)
+    if not tfile or tfile.IsZombie():
+        raise error("Could not open {}".format(root_path))
+    try:
+        index = keyindex.KeyIndex(tfile, main_gdir)
+        hists = {}
+        for hconf in config["hists"]:
+            h = hconf["path"].split("/")[-1]
+            dirname = main_gdir + hconf["path"][:-len(h)]
+            for info in index.glob(dirname, h):
+                path = (dirname + info.name)[len(main_gdir):]
+                if path in hists:
+                    continue
+                hist = tfile.Get(dirname + info.name)
+                hists[path] = histdata.from_hist(hist)
+    finally:
+        tfile.Close()
+
+    write_run(store_dir, run, hists, subsystem)
+    return list(hists)
+
+
+def write_run(store_dir, run, hists, subsystem=None):
+    """Write a {path: HistData} dict as the store entry of run of
+    subsystem, replacing any existing one."""
+    # {column: [arrays]} and the running size of each column
+    columns = {}
+    sizes = {}
+
+    def append(key, arr):
+        """Add arr to column key and return its [offset, shape] there."""
+        arr = np.asarray(arr, dtype=np.float64)
+        offset = sizes.get(key, 0)
+        # Flatten in [x, y] index order so that reshape restores the view
+        columns.setdefault(key, []).append(arr.ravel())
+        sizes[key] = offset + arr.size
+        return [offset, list(arr.shape)]
+
+    entries = {}
+    for path, hd in hists.items():
+        arrays = {'contents': hd.contents, 'sumw2': hd.sumw2}
+        if hd.profile:
+            for key in _PROFILE_COLUMNS:
+                arrays[key] = hd.profile[key]
+        entry = {
+            'name': hd.name,
+            'title': hd.title,
+            'class_name': hd.class_name,
+            'entries': float(hd.entries),
+            'stats': None if hd.stats is None else [float(s) for s in hd.stats],
+            'axes': [{'title': ax.title, 'labels': ax.labels,
+                      'edges': append('edges', ax.edges)}
+                     for ax in hd.axes],
+            'arrays': {key: append(key, arr)
+                       for key, arr in arrays.items() if arr is not None},
+            'erroroption': hd.profile['erroroption'] if hd.profile else None,
+        }
+        entries[path] = entry
+
+    run_dir = _run_dir(store_dir, run, subsystem)
+    parent, name = os.path.split(run_dir)
+    os.makedirs(parent, exist_ok=True)
+    # Each writer has its own directory, so concurrent writers of a run
+    # never write into each other's files
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.' + name + '.')
+    try:
+        for key, parts in columns.items():
+            np.save(os.path.join(tmp_dir, key + '.npy'),
+                    np.concatenate(parts))
+        with open(os.path.join(tmp_dir, INDEX_NAME), 'w') as f:
+            json.dump({'version': STORE_VERSION, 'run': str(run),
+                       'hists': entries}, f)
+        os.chmod(tmp_dir, 0o755)
+        link = tmp_dir + '.link'
+        os.symlink(os.path.basename(tmp_dir), link)
+    except:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    # Writers of a run take turns to swap their entry in, so that each
+    # removes exactly the one it replaced
+    with open(os.path.join(parent, '.' + name + '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        old_dir = None
+        if os.path.islink(run_dir):
+            old_dir = os.path.join(parent, os.readlink(run_dir))
+        elif os.path.isdir(run_dir):
+            # An entry written before entries were symlinks
+            old_dir = tempfile.mkdtemp(dir=parent, prefix='.' + name + '.')
+            os.replace(run_dir, old_dir)
+        # Swap the complete entry in, so readers never see a partial run
+        os.replace(link, run_dir)
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def read_run(store_dir, run, paths=None, mmap_mode='r', subsystem=None):
+    """Return {path: HistData} for the histograms of run of subsystem in
+    store_dir, or those among paths. The arrays are read-only views of the
+    memory-mapped columns unless mmap_mode is None."""
+    entry_dir = _run_dir(store_dir, run, subsystem)
+    while True:
+        run_dir = os.path.realpath(entry_dir)
+        try:
+            return _read_entry(store_dir, run, run_dir, paths, mmap_mode)
+        except FileNotFoundError:
+            # Retry if the entry was written again while being read
+            if os.path.realpath(entry_dir) == run_dir:
+                raise error("Run {} not found in store {}".format(
+                    run, store_dir))
+
+
+def _read_entry(store_dir, run, run_dir, paths, mmap_mode):
+    with open(os.path.join(run_dir, INDEX_NAME)) as f:
+        index = json.load(f)
+    if index['version'] != STORE_VERSION:
+        raise error("Run {} in store {} has version {}, expected {}".format(
+            run, store_dir, index['version'], STORE_VERSION))
+
+    entries = index['hists']
+    if paths is not None:
+        missing = [p for p in paths if p not in entries]
+        if missing:
+            raise error("Histograms {} of run {} not in store".format(
+                missing, run))
+        entries = {p: entries[p] for p in paths}
+
+    columns = {}
+
+    def column(key):
+        if key not in columns:
+            columns[key] = np.load(os.path.join(run_dir, key + '.npy'),
+                                   mmap_mode=mmap_mode)
+        return columns[key]
+
+    def array(key, span):
+        offset, shape = span
+        size = int(np.prod(shape))
+        return column(key)[offset:offset + size].reshape(shape)
+
+    hists = {}
+    for path, entry in entries.items():
+        arrays = {key: array(key, span)
+                  for key, span in entry['arrays'].items()}
+        axes = tuple(AxisData(ax['title'], array('edges', ax['edges']),
+                              ax['labels'])
+                     for ax in entry['axes'])
+
+        profile = None
+        if entry['erroroption'] is not None:
+            profile = {key: arrays.get(key) for key in _PROFILE_COLUMNS}
+            profile['erroroption'] = entry['erroroption']
+
+        stats = entry['stats']
+        hists[path] = HistData(
+            entry['name'], entry['title'], entry['class_name'], axes,
+            arrays['contents'], arrays.get('sumw2'), entry['entries'],
+            None if stats is None else np.array(stats), profile)
+    return hists
+
+
+def list_runs(store_dir, subsystem=None):
+    """Return the runs of subsystem in store_dir."""
+    top = _run_dir(store_dir, '', subsystem)
+    if not os.path.isdir(top):
+        return []
+    return sorted(name for name in os.listdir(top)
+                  if not name.startswith('.')
+                  and os.path.isfile(os.path.join(top, name, INDEX_NAME)))
+
+
+def index_path(store_dir, run, subsystem=None):
+    """Return the path of the index of run of subsystem in store_dir."""
+    return os.path.join(_run_dir(store_dir, run, subsystem), INDEX_NAME)
+
+
+def _run_dir(store_dir, run, subsystem=None):
+    if subsystem is None:
+        return os.path.join(store_dir, str(run))
+    return os.path.join(store_dir, subsystem, str(run))
+
+
+class error(Exception):
+    pass
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) != 6:
+        sys.exit("usage: histstore.py config_dir subsystem run root_path "
+                 "store_dir")
+    config_dir, subsystem, run, root_path, store_dir = sys.argv[1:]
+    paths = convert(config_dir, subsystem, run, root_path, store_dir)
+    print("Stored {} histograms of run {} in {}".format(
+        len(paths), run, store_dir))
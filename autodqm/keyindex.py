@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Index of the keys in a ROOT file, built without reading the objects."""
+
+from collections import namedtuple
+import fnmatch
+import ROOT
+
+KeyInfo = namedtuple('KeyInfo', ('dirname', 'name', 'class_name', 'cycle'))
+
+
+class KeyIndex(object):
+    """Map from the path of each object under a directory of a ROOT file to
+    its KeyInfo.
+
+    Directory paths end in '/' and object paths are their directory path
+    plus the object name, as in main_gdir + hconf["path"]. Only the highest
+    cycle of each name is kept.
+
+    With dirs, only the keys of those directories are read, and not those
+    of every directory under top, which for a file read over the network
+    saves a request per directory left out.
+    """
+
+    def __init__(self, tfile, top, dirs=None):
+        self.top = top.rstrip('/') + '/'
+        self.keys = dict()
+        # {dirname: {name: KeyInfo}} for every directory under top, or
+        # every one of dirs found in the file
+        self.dirs = dict()
+
+        if not tfile.GetDirectory(self.top):
+            raise error("Directory {} not found in {}".format(
+                self.top, tfile.GetName()))
+        if dirs is None:
+            self._walk(tfile.GetDirectory(self.top), self.top)
+            return
+        for dirname in dirs:
+            dirname = dirname.rstrip('/') + '/'
+            tdir = tfile.GetDirectory(dirname)
+            if tdir and dirname not in self.dirs:
+                self._walk(tdir, dirname, recurse=False)
+
+    def __contains__(self, path):
+        return path in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def has_dir(self, dirname):
+        return dirname in self.dirs
+
+    def glob(self, dirname, pattern):
+        """Return the KeyInfos of the histograms in dirname whose names
+        match the shell-style pattern, in key order."""
+        entries = self.dirs.get(dirname, {})
+        if not any(c in pattern for c in '*?['):
+            info = entries.get(pattern)
+            return [info] if info and is_hist(info) else []
+        return [info for name, info in entries.items()
+                if is_hist(info) and fnmatch.fnmatchcase(name, pattern)]
+
+    def hists(self):
+        """Return the paths of every histogram in the index, in key
+        order."""
+        return [path for path, info in self.keys.items() if is_hist(info)]
+
+    def _walk(self, tdir, dirname, recurse=True):
+        entries = self.dirs.setdefault(dirname, dict())
+        for key in tdir.GetListOfKeys():
+            name = key.GetName()
+            if name in entries and entries[name].cycle >= key.GetCycle():
+                continue
+            info = KeyInfo(dirname, name, key.GetClassName(), key.GetCycle())
+            entries[name] = info
+            self.keys[dirname + name] = info
+            if recurse and _inherits(info.class_name, 'TDirectory'):
+                self._walk(tdir.GetDirectory(name), dirname + name + '/')
+
+
+def is_hist(info):
+    """Return whether the object behind a KeyInfo is a TH1 or TH2."""
+    return _inherits(info.class_name, 'TH1')
+
+
+def unmonitored(index, monitored):
+    """Return the paths of the histograms in index not among the paths in
+    monitored, in key order."""
+    monitored = set(monitored)
+    return [path for path in index.hists() if path not in monitored]
+
+
+def _inherits(class_name, base):
+    if (class_name, base) not in _inherits_cache:
+        cls = ROOT.TClass.GetClass(class_name)
+        _inherits_cache[class_name, base] = bool(cls) and bool(
+            cls.InheritsFrom(base))
+    return _inherits_cache[class_name, base]
+
+
+_inherits_cache = {}
+
+
+class error(Exception):
+    """Raised by keyindex, and shared by refsession and compare_hists, so
+    that catching compare_hists.error also catches a file missing the
+    configured directories."""
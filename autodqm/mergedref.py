@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Reference histograms merged from several runs of a histstore.
+
+A merged reference is the bin-by-bin sum of the runs' histograms, as
+TH1::Add would make it: contents, sums of squared weights, entries and
+statistics add, and profiles add their raw sums before being projected
+again. It is built from the memory-mapped columns without ROOT, and is
+itself saved as a histstore run under a key derived from the runs it was
+built from, so later sessions read it back instead of merging again.
+"""
+
+import hashlib
+import numpy as np
+
+import histstore
+from histdata import project_profile
+
+# Separates the runs in the ref_run label of a merged reference
+RUN_SEP = '+'
+
+
+def merged_ref(store_dir, runs, paths=None, cache_dir=None, subsystem=None):
+    """Return {path: HistData} of the runs of subsystem in store_dir merged,
+    for every histogram in any of them or only those among paths.
+
+    With cache_dir, the result is read from there if it was merged before
+    and saved there otherwise.
+    """
+    if not runs:
+        raise error("No runs to merge")
+    if cache_dir is not None:
+        key = merge_key(store_dir, runs, paths, subsystem)
+        if key in histstore.list_runs(cache_dir):
+            return histstore.read_run(cache_dir, key)
+
+    per_run = [histstore.read_run(store_dir, run, subsystem=subsystem)
+               for run in runs]
+    if paths is None:
+        paths = []
+        for hists in per_run:
+            paths += [p for p in hists if p not in paths]
+
+    merged = {}
+    for path in paths:
+        parts = [hists[path] for hists in per_run if path in hists]
+        if not parts:
+            raise error("Histogram {} is in none of runs {}".format(
+                path, runs))
+        merged[path] = merge_hists(parts)
+
+    if cache_dir is not None:
+        histstore.write_run(cache_dir, key, merged)
+        return histstore.read_run(cache_dir, key)
+    return merged
+
+
+def merge_hists(hists):
+    """Return the sum of HistData of the same class and binning."""
+    first = hists[0]
+    for hd in hists[1:]:
+        if (hd.class_name != first.class_name
+                or len(hd.axes) != len(first.axes)
+                or not all(np.array_equal(a.edges, b.edges)
+                           for a, b in zip(hd.axes, first.axes))):
+            raise error("Cannot merge {} {} with {} {} of different "
+                        "binning".format(first.class_name, first.name,
+                                         hd.class_name, hd.name))
+
+    if first.profile:
+        profile = {'erroroption': first.profile['erroroption']}
+        for key in ('sumwy', 'sumwy2', 'binentries'):
+            profile[key] = _sum([hd.profile[key] for hd in hists])
+        # Profiles filled with unit weights only store their bin entries
+        profile['binsumw2'] = _sum(
+            [hd.profile['binsumw2'] for hd in hists],
+            [hd.profile['binentries'] for hd in hists])
+        contents, sumw2 = project_profile(profile)
+    else:
+        profile = None
+        contents = _sum([hd.contents for hd in hists])
+        # Histograms without sumw2 were filled with unit weights
+        sumw2 = _sum([hd.sumw2 for hd in hists],
+                     [hd.contents for hd in hists])
+
+    stats = None
+    if all(hd.stats is not None for hd in hists):
+        stats = _sum([hd.stats for hd in hists])
+
+    return first._replace(
+        contents=contents, sumw2=sumw2, profile=profile, stats=stats,
+        entries=float(sum(hd.entries for hd in hists)))
+
+
+def merge_key(store_dir, runs, paths=None, subsystem=None):
+    """Return the cache key of a merged reference, which changes with the
+    runs and paths it is built from and with the store indices of the
+    runs, and so whenever a run is converted again with new contents."""
+    h = hashlib.sha1()
+    for run in sorted(str(run) for run in runs):
+        h.update(run.encode() + b'\0')
+        with open(histstore.index_path(store_dir, run, subsystem),
+                  'rb') as f:
+            h.update(hashlib.sha1(f.read()).digest())
+    if paths is not None:
+        for path in sorted(paths):
+            h.update(path.encode() + b'\0')
+    return 'merged-' + h.hexdigest()
+
+
+def ref_label(runs):
+    """Return the ref_run label of a reference merged from runs."""
+    return RUN_SEP.join(str(run) for run in runs)
+
+
+def _sum(arrays, defaults=None):
+    """Return the sum of arrays, taking None entries from defaults, or None
+    if every entry is None."""
+    if all(arr is None for arr in arrays):
+        return None
+    if defaults is not None:
+        arrays = [d if arr is None else arr
+                  for arr, d in zip(arrays, defaults)]
+    return np.sum(np.stack(arrays), axis=0)
+
+
+class error(Exception):
+    pass
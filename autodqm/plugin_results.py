@@ -9,10 +9,14 @@ class PluginResults(object):
     self.show: whether the canvas should be shown by default
     self.info: dictionary of any extra information that should be displayed
     self.artifacts: root objects that need to be protected from garbage collection
+    self.plot: keyword arguments of the plugin's renderer for this result,
+        holding only numbers and arrays so that it can be drawn later
     """
 
-    def __init__(self, canvas, show=False, info={}, artifacts=[]):
+    def __init__(self, canvas=None, show=False, info={}, artifacts=[],
+                 plot=None):
         self.canvas = canvas
         self.show = show
         self.info = info
         self.root_artifacts = artifacts
+        self.plot = plot
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import fnmatch
+import functools
+import os
+import ROOT
+import cfg
+import keyindex
+from keyindex import error
+from histdata import to_hist
+from histpair import HistPair, prepare_ref
+
+
+class RefSession(object):
+    """A reference run's configured histograms, loaded and prepared once to
+    be compared against any number of data runs.
+
+    The ref file is read once, in the constructor. Every HistPair that bind
+    returns shares the session's ref histograms and their RefPrep, so
+    comparators must treat ref_hist as read-only.
+
+    ref_hists is an optional {path below main_gdir: HistData} dict, such as
+    a histstore run or a merged reference, to take the ref histograms from
+    instead of the ROOT file at ref_path.
+
+    With preload False, only the ref keys are read in the constructor, and
+    each ref histogram is read and prepared again for every pair that uses
+    it, so that the session holds no more than one pair's worth of them at
+    a time.
+
+    Several sessions can share one open ref file: config is the subsystem's
+    configuration, if already loaded, and ref_file and ref_index an open
+    ref file and a KeyIndex of it holding the subsystem's directories, to
+    use instead of opening ref_path. They are not closed by the session,
+    and without preload must stay open while its pairs are used.
+    """
+
+    def __init__(self, config_dir, subsystem,
+                 ref_series, ref_sample, ref_run, ref_path=None,
+                 ref_hists=None, preload=True, config=None, ref_file=None,
+                 ref_index=None):
+        if config is None:
+            config = cfg.get_subsystem(config_dir, subsystem)
+        self.main_gdir = config["main_gdir"]
+        self.ref_series = ref_series
+        self.ref_sample = ref_sample
+        self.ref_run = ref_run
+        self.ref_path = ref_path
+        self.ref_hists = ref_hists
+        self.preload = preload
+        self.ref_file = ref_file
+
+        # (hconf, gdir, pattern, {name: (ref_hist, ref_prep)}) for each
+        # configured histogram path, or {name: path of the ref histogram}
+        # without preload
+        self.entries = []
+
+        if ref_hists is not None:
+            self._load_hists(config["hists"], ref_hists, ref_run)
+            return
+
+        own_file = ref_file is None
+        if own_file:
+            ref_file = open_file(ref_path)
+        try:
+            index = ref_index
+            if index is None:
+                index = keyindex.KeyIndex(ref_file,
+                                          self.main_gdir.format(ref_run))
+            loaded = {}
+            for hconf in config["hists"]:
+                # Get name of hist in root file
+                h = str(hconf["path"].split("/")[-1])
+                # Get parent directory of hist
+                gdir = hconf["path"][:-len(h)]
+
+                ref_dirname = "{0}{1}".format(
+                    self.main_gdir.format(ref_run), gdir)
+                if not index.has_dir(ref_dirname):
+                    raise error(
+                        "Subsystem dir {0} not found in ref root file".format(ref_dirname))
+
+                refs = {}
+                for info in index.glob(ref_dirname, h):
+                    path = ref_dirname + info.name
+                    if not preload:
+                        refs[info.name] = path
+                        continue
+                    # Paths matched by several config entries load once
+                    if path not in loaded:
+                        ref_hist = _read_hist(ref_file, path)
+                        loaded[path] = (ref_hist, prepare_ref(ref_hist))
+                    refs[info.name] = loaded[path]
+                self.entries.append((hconf, gdir, h, refs))
+        finally:
+            if own_file:
+                ref_file.Close()
+
+    def _load_hists(self, conf_list, ref_hists, ref_run):
+        dirs = _group_dirs(ref_hists)
+        loaded = {}
+        for hconf in conf_list:
+            h = str(hconf["path"].split("/")[-1])
+            gdir = hconf["path"][:-len(h)]
+            if gdir not in dirs:
+                raise error(
+                    "Subsystem dir {0} not found in ref hists".format(
+                        self.main_gdir.format(ref_run) + gdir))
+
+            refs = {}
+            for name in dirs.get(gdir, ()):
+                if not fnmatch.fnmatchcase(name, h):
+                    continue
+                path = gdir + name
+                if not self.preload:
+                    refs[name] = path
+                    continue
+                if path not in loaded:
+                    ref_hist = to_hist(ref_hists[path])
+                    loaded[path] = (ref_hist, prepare_ref(ref_hist))
+                refs[name] = loaded[path]
+            self.entries.append((hconf, gdir, h, refs))
+
+    def bind(self, data_series, data_sample, data_run, data_path,
+             data_hists=None, data_file=None, data_index=None):
+        """Return the HistPairs of a data run against the session's ref
+        run, in config order.
+
+        data_hists is an optional {path below main_gdir: HistData} dict,
+        such as a histstore run or one read with remote.read_hists, to take
+        the data histograms from instead of the ROOT file at data_path.
+        data_file and data_index are an open data file and a KeyIndex of
+        it, shared as ref_file and ref_index are."""
+        pairs = []
+        for hp in self.iter_bind(data_series, data_sample, data_run,
+                                 data_path, data_hists, data_file,
+                                 data_index):
+            # The files are closed once iter_bind is exhausted
+            hp.load()
+            pairs.append(hp)
+        return pairs
+
+    def iter_bind(self, data_series, data_sample, data_run, data_path,
+                  data_hists=None, data_file=None, data_index=None):
+        """Yield the HistPairs of bind one at a time. Their histograms are
+        read when first used, and the data and ref files stay open for that
+        until the generator is exhausted or closed; a pair read from after
+        that raises error, so call load on the pairs to keep.
+
+        Reading lazily pays off for callers that skip some of the pairs,
+        and keeps no more than the pairs in use in memory. It saves no reads
+        in compare_hists with a cache or workers, where pair_digest and
+        _pack_histpair read both histograms of every pair."""
+        ref_file = self.ref_file
+        own_ref = (not self.preload and self.ref_hists is None
+                   and ref_file is None)
+        if own_ref:
+            ref_file = open_file(self.ref_path)
+        try:
+            if data_hists is not None:
+                yield from self._iter_bind_hists(
+                    data_series, data_sample, data_run, data_hists, ref_file)
+            else:
+                yield from self._iter_bind_file(
+                    data_series, data_sample, data_run, data_path, ref_file,
+                    data_file, data_index)
+        finally:
+            if own_ref:
+                ref_file.Close()
+
+    def _iter_bind_file(self, data_series, data_sample, data_run, data_path,
+                        ref_file, data_file, data_index):
+        own_file = data_file is None
+        if own_file:
+            data_file = open_file(data_path)
+        try:
+            own_index = data_index is None
+            if own_index:
+                data_index = keyindex.KeyIndex(
+                    data_file, self.main_gdir.format(data_run))
+
+            histlist = []
+            for hconf, gdir, h, refs in self.entries:
+                data_dirname = "{0}{1}".format(
+                    self.main_gdir.format(data_run), gdir)
+                if not data_index.has_dir(data_dirname):
+                    raise error(
+                        "Subsystem dir {0} not found in data root file".format(data_dirname))
+
+                # Histograms matching h in both files
+                for info in data_index.glob(data_dirname, h):
+                    if info.name not in refs:
+                        continue
+                    ref_hist, ref_prep, ref_loader = self._ref(
+                        refs[info.name], ref_file)
+                    histlist.append(data_dirname + info.name)
+
+                    yield HistPair(
+                        hconf,
+                        data_series, data_sample, data_run, info.name, None,
+                        self.ref_series, self.ref_sample, self.ref_run,
+                        info.name, ref_hist, ref_prep,
+                        data_loader=functools.partial(
+                            _read_hist, data_file, data_dirname + info.name),
+                        ref_loader=ref_loader)
+
+            # A shared index also holds the hists of other subsystems
+            if own_index:
+                dqmhists = keyindex.unmonitored(data_index, histlist)
+
+            ## write out dqmhists to a file
+
+        finally:
+            if own_file:
+                data_file.Close()
+
+    def _iter_bind_hists(self, data_series, data_sample, data_run,
+                         data_hists, ref_file):
+        dirs = _group_dirs(data_hists)
+        for hconf, gdir, h, refs in self.entries:
+            if gdir not in dirs:
+                raise error(
+                    "Subsystem dir {0} not found in data hists".format(
+                        self.main_gdir.format(data_run) + gdir))
+            for name in dirs[gdir]:
+                if name not in refs or not fnmatch.fnmatchcase(name, h):
+                    continue
+                ref_hist, ref_prep, ref_loader = self._ref(refs[name],
+                                                           ref_file)
+                yield HistPair(
+                    hconf,
+                    data_series, data_sample, data_run, name, None,
+                    self.ref_series, self.ref_sample, self.ref_run,
+                    name, ref_hist, ref_prep,
+                    data_loader=functools.partial(
+                        to_hist, data_hists[gdir + name]),
+                    ref_loader=ref_loader)
+
+    def _ref(self, ref, ref_file):
+        """Return the (ref_hist, ref_prep, ref_loader) HistPair arguments of
+        an entry of refs. Without preload the ref histogram is left to the
+        loader, which reads it from ref_file or ref_hists."""
+        if self.preload:
+            return ref + (None,)
+        if self.ref_hists is not None:
+            return None, None, functools.partial(to_hist, self.ref_hists[ref])
+        return None, None, functools.partial(_read_hist, ref_file, ref)
+
+
+def shared_index(tfile, run, configs):
+    """Return a KeyIndex of tfile for run holding the directories of every
+    configured histogram path of the subsystem configs, to be shared by
+    their sessions as ref_index or data_index."""
+    main_gdirs = [config["main_gdir"].format(run) for config in configs]
+    dirs = []
+    for main_gdir, config in zip(main_gdirs, configs):
+        for hconf in config["hists"]:
+            h = hconf["path"].split("/")[-1]
+            dirs.append(main_gdir + hconf["path"][:-len(h)])
+    # The deepest directory above every main_gdir
+    top = os.path.commonprefix(main_gdirs).rpartition('/')[0]
+    return keyindex.KeyIndex(tfile, top, dirs=dirs)
+
+
+def missing_dirs(index, run, config):
+    """Return the directories of the configured histogram paths of config
+    for run that are not in the KeyIndex index, in config order."""
+    missing = []
+    for hconf in config["hists"]:
+        h = hconf["path"].split("/")[-1]
+        dirname = config["main_gdir"].format(run) + hconf["path"][:-len(h)]
+        if not index.has_dir(dirname) and dirname not in missing:
+            missing.append(dirname)
+    return missing
+
+
+def open_file(path):
+    """Open the ROOT file at path for reading."""
+    tfile = ROOT.TFile.Open(path)
+    if not tfile or tfile.IsZombie():
+        raise error("Failed to open file {}".format(path))
+    return tfile
+
+
+def _read_hist(tfile, path):
+    """Return a detached copy of the histogram at path in tfile."""
+    if not tfile.IsOpen():
+        raise error("Cannot read {0} from {1}, which was closed; load the "
+                    "pairs of iter_bind before it is exhausted".format(
+                        path, tfile.GetName()))
+    hist = tfile.Get(path)
+    hist.SetDirectory(0)
+    ROOT.SetOwnership(hist, True)
+    return hist
+
+
+def _group_dirs(hists):
+    """Return the names in a {path: HistData} dict grouped by directory, as
+    {dirname: [name]} like the entries of a KeyIndex."""
+    dirs = {}
+    for path in hists:
+        gdir, _, name = path.rpartition('/')
+        dirs.setdefault(gdir + '/' if gdir else '', []).append(name)
+    return dirs
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Configured histograms of DQM ROOT files read over the network.
+
+ROOT opens a file given by its URL with byte-range requests: the header,
+the key lists of the directories it is asked about and the baskets of the
+objects it reads, and nothing else. Reading the few configured histograms
+of a run this way costs a handful of small requests instead of the
+download of the whole file by DQMSession.stream_run.
+
+Histograms read are cached one object at a time as HistData, keyed by the
+URL and version of their file and their path, together with the paths the
+configuration matched in the file. A run read again is then served from
+the cache without opening the file at all, and one read with a different
+configuration only fetches the histograms it lacks. They are kept in the
+CACHE_NAMESPACE subdirectory of the cache given, so that a cache shared
+with compare_hists.process bounds histograms and results separately.
+
+Histograms are keyed by their path below the subsystem's main_gdir, as in
+histstore, so the result can stand in for a run file in RefSession and
+compare_hists.process.
+"""
+
+import hashlib
+import ROOT
+
+import cfg
+import histdata
+import keyindex
+
+# Subdirectory of a ResultCache that holds the histograms read
+CACHE_NAMESPACE = 'remote'
+
+# Class of the http(s) plugin handler of ROOT releases, such as 6.40, that
+# name its constructor by the qualified class name, which the plugin
+# manager does not find
+_WEB_FILE_CLASS = 'ROOT::Deprecated::TWebFile'
+_web_file_fixed = False
+
+
+def read_hists(config_dir, subsystem, run, url, version='', cache=None,
+               cert=None):
+    """Return {path below main_gdir: HistData} of the histograms configured
+    for subsystem in the DQM ROOT file of run at url.
+
+    version identifies the contents of the file, such as its size and date
+    in the DQM listing, so that cached histograms of an earlier version are
+    not used. cache is an optional ResultCache to keep the histograms in.
+    cert is the client certificate, a path or a (cert, key) tuple.
+
+    Raises error if a configured directory is not in the file."""
+    config = cfg.get_subsystem(config_dir, subsystem)
+    main_gdir = config["main_gdir"].format(run)
+
+    # (directory, name pattern) of each configured histogram path
+    patterns = []
+    for hconf in config["hists"]:
+        h = hconf["path"].split("/")[-1]
+        patterns.append((main_gdir + hconf["path"][:-len(h)], h))
+
+    paths_key = object_key(url, version, '\0'.join(
+        [main_gdir] + ['{}\0{}'.format(d, h) for d, h in patterns]))
+    hists = {}
+    if cache is not None:
+        cache = cache.namespace(CACHE_NAMESPACE)
+        paths = cache.get(paths_key)
+        if paths is not None:
+            for path in paths:
+                hd = cache.get(object_key(url, version, path))
+                if hd is None:
+                    break
+                hists[path] = hd
+            else:
+                return hists
+
+    tfile = open_url(url, cert)
+    try:
+        index = keyindex.KeyIndex(tfile, main_gdir,
+                                  dirs=[d for d, _ in patterns])
+        # {path below main_gdir: path in the file} of the matches, in
+        # config order
+        found = {}
+        for dirname, h in patterns:
+            if not index.has_dir(dirname):
+                raise error("Subsystem dir {0} not found in {1}".format(
+                    dirname, url))
+            for info in index.glob(dirname, h):
+                found.setdefault((dirname + info.name)[len(main_gdir):],
+                                 dirname + info.name)
+        for path, file_path in found.items():
+            if path in hists:
+                continue
+            key = object_key(url, version, path)
+            hd = cache.get(key) if cache is not None else None
+            if hd is None:
+                hd = histdata.from_hist(tfile.Get(file_path))
+                if cache is not None:
+                    cache.put(key, hd)
+            hists[path] = hd
+    finally:
+        tfile.Close()
+
+    if cache is not None:
+        cache.put(paths_key, list(found))
+    return {path: hists[path] for path in found}
+
+
+def read_run(sess, config_dir, subsystem, series, sample, run, cache=None):
+    """Return read_hists of a run on DQM Offline, looked up and
+    authenticated through the DQMSession sess."""
+    row = sess.find_runs(series, sample, [run])[run]
+    return read_hists(config_dir, subsystem, run, row.url,
+                      '{} {}'.format(row.size, row.date), cache, sess.cert)
+
+
+def open_url(url, cert=None):
+    """Open the ROOT file at url for reading with byte-range requests.
+
+    cert is set as the client certificate of the Davix plugin that opens
+    https URLs only while the file is opened, and the settings it replaces
+    are restored after."""
+    _fix_web_file()
+    # Read by the Davix plugin when it opens the file
+    settings = {}
+    if cert is not None:
+        cert_path, key_path = cert if isinstance(cert, tuple) else (cert, cert)
+        settings = {'Davix.GSI.UserCert': cert_path,
+                    'Davix.GSI.UserKey': key_path}
+    saved = {}
+    for name in settings:
+        rec = ROOT.gEnv.Lookup(name)
+        saved[name] = rec.GetValue() if rec else None
+    try:
+        for name, value in settings.items():
+            ROOT.gEnv.SetValue(name, value)
+        try:
+            tfile = ROOT.TFile.Open(url)
+        except OSError:
+            tfile = None
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                ROOT.gEnv.GetTable().Remove(ROOT.gEnv.Lookup(name))
+            else:
+                ROOT.gEnv.SetValue(name, value)
+    if not tfile or tfile.IsZombie():
+        raise error("Failed to open file {}".format(url))
+    return tfile
+
+
+def _fix_web_file():
+    """Register the http(s) plugin handler of ROOT again with the
+    constructor of its TWebFile found, where the release names it by the
+    qualified class name."""
+    global _web_file_fixed
+    if _web_file_fixed:
+        return
+    handler = ROOT.gPluginMgr.FindHandler('TFile', 'http://')
+    if handler and handler.GetClass() == _WEB_FILE_CLASS:
+        ROOT.gPluginMgr.AddHandler('TFile', '^http[s]?:', _WEB_FILE_CLASS,
+                                   'Net', 'TWebFile(const char*,Option_t*)')
+    _web_file_fixed = True
+
+
+def object_key(url, version, path):
+    """Return the cache key of the object at path in the file at url."""
+    h = hashlib.sha1()
+    for part in ('remote', url, version, path):
+        h.update(part.encode() + b'\0')
+    return h.hexdigest()
+
+
+class error(Exception):
+    pass
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Persistent cache of comparator results, keyed by the content they were
+computed from."""
+
+import hashlib
+import importlib.util
+import inspect
+import os
+import pickle
+import tempfile
+
+import histdata
+
+# Default size bound of a ResultCache
+MAX_BYTES = 1 << 30
+
+CACHE_EXT = '.pkl'
+
+# Bump to invalidate every cached result, e.g. when the meaning of a
+# comparator's inputs changes outside of the sources hashed below
+CACHE_VERSION = '1'
+
+# Modules the comparators compute their results with, whose sources are
+# part of every key along with the source of the comparator's plugin
+SHARED_MODULES = ('histdata', 'pullstats', 'plugin_results')
+
+
+class ResultCache(object):
+    """Directory of pickled comparator results with size-bounded LRU
+    eviction.
+
+    Entries are files named by their key. Reading an entry refreshes its
+    modification time, which orders the entries for eviction, so several
+    processes can share a cache directory.
+    """
+
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def namespace(self, name):
+        """Return a ResultCache in the subdirectory name, with the same
+        max_bytes, for entries that should not compete with comparator
+        results for eviction."""
+        return ResultCache(os.path.join(self.path, name), self.max_bytes)
+
+    def get(self, key):
+        """Return the value stored under key, or None."""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return value
+
+    def put(self, key, value):
+        """Store value under key, then evict the least recently used entries
+        until the cache fits in max_bytes."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._entry_path(key))
+        except:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries beyond max_bytes."""
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith(CACHE_EXT):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + CACHE_EXT)
+
+
+def pair_digest(hp):
+    """Return a digest of the identity, config and bin contents of a
+    HistPair. Take it before any comparator normalizes the histograms."""
+    h = hashlib.sha1(hp.digest().encode())
+    for hist in (hp.data_hist, hp.ref_hist):
+        histdata.update_digest(h, histdata.from_hist(hist))
+    return h.hexdigest()
+
+
+def result_key(pair_digest, comp_name, comparator):
+    """Return the cache key of a comparator result on a HistPair."""
+    h = hashlib.sha1(pair_digest.encode())
+    h.update(comp_name.encode())
+    h.update(plugin_version(comparator).encode())
+    return h.hexdigest()
+
+
+def plugin_version(comparator):
+    """Return a digest of CACHE_VERSION and of the sources of the plugin
+    module that defines a comparator and of SHARED_MODULES, so that editing
+    a plugin or the code it computes with invalidates its results."""
+    h = hashlib.sha1(CACHE_VERSION.encode())
+    h.update(_source_digest(inspect.getsourcefile(comparator)).encode())
+    for name in SHARED_MODULES:
+        spec = importlib.util.find_spec(name)
+        if spec is not None and spec.origin:
+            h.update(_source_digest(spec.origin).encode())
+    return h.hexdigest()
+
+
+def _source_digest(path):
+    if path not in _versions:
+        with open(path, 'rb') as f:
+            _versions[path] = hashlib.sha1(f.read()).hexdigest()
+    return _versions[path]
+
+
+_versions = {}
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compact, ROOT-free records of comparator results.
+
+A ResultRecord holds what an analysis of many results needs: the names of
+the histogram, comparator and runs, the info statistics of the comparator
+and the data, ref and pull maps as contiguous float64 arrays. It pickles as
+a plain tuple of those, so records can cross process boundaries and be
+stored without ROOT, unlike the output dicts of compare_hists.process.
+"""
+
+from collections import namedtuple
+import numpy as np
+
+from histdata import bin_views
+
+
+class ResultRecord(namedtuple('ResultRecord', (
+        'id', 'comparator', 'name',
+        'data_series', 'data_sample', 'data_run',
+        'ref_series', 'ref_sample', 'ref_run',
+        'display', 'info', 'data', 'ref', 'pull'))):
+    """Data class for one comparator result.
+
+    data and ref are the bin contents of the histograms as read, before any
+    comparator normalizes them, and pull is the pull map of comparators
+    that make one, else None. They are indexed [x] or [x, y] like
+    bin_arrays, without under- and overflow.
+    """
+    __slots__ = ()
+
+    @property
+    def nbins(self):
+        return self.data.size
+
+    @property
+    def dimension(self):
+        return self.data.ndim
+
+
+def pair_maps(hp):
+    """Return the (data, ref) maps of a HistPair for its records. Take them
+    before the comparators run, as they may normalize data_hist in place."""
+    data = bin_views(hp.data_hist, flow=False)
+    return (np.array(data.contents, dtype=np.float64, order='C'),
+            _in_range(hp.ref_prep.vals))
+
+
+def make_record(hp, maps, comp_name, result_id, show, info, plot):
+    """Return the ResultRecord of one comparator result on hp, with maps
+    from pair_maps."""
+    pull = (plot or {}).get('pull_hist')
+    return ResultRecord(
+        result_id, comp_name, hp.data_name,
+        hp.data_series, hp.data_sample, hp.data_run,
+        hp.ref_series, hp.ref_sample, hp.ref_run,
+        bool(show or hp.config.get('always_show', False)), info,
+        maps[0], maps[1],
+        None if pull is None else _in_range(pull.contents))
+
+
+def _in_range(vals):
+    """Return the in-range bins of a bin_arrays array as a contiguous
+    float64 array."""
+    return np.ascontiguousarray(vals[(slice(1, -1),) * vals.ndim],
+                                dtype=np.float64)
@@ -11,9 +11,7 @@ import importlib.util
 spec = importlib.util.spec_from_file_location('compare_hists', '/home/chosila/Projects/2018metaAnalysis/autodqm/compare_hists.py')
 compare_hists = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(compare_hists)
-import ROOT
 import pickle
-import root_numpy
 import matplotlib.pyplot as plt
 import os
 import numpy as np
@@ -146,95 +144,66 @@ run2d = list()
 data_run = data_path[-11:-5]
 print(f'ref path: {ref_path}')
 print(f'data path: {data_path}')
-results = compare_hists.process(config_dir, subsystem,
-                                data_series, data_sample, data_run, data_path,
-                                ref_series, ref_sample, ref_run, ref_path,
-                                output_dir='./out/', plugin_dir='/home/chosila/Projects/2018metaAnalysis/plugins')
+results = compare_hists.iter_records(config_dir, subsystem,
+                                     data_series, data_sample, data_run, data_path,
+                                     ref_series, ref_sample, ref_run, ref_path,
+                                     output_dir='./out/', plugin_dir='/home/chosila/Projects/2018metaAnalysis/plugins')
 
-for result in results:
-    hists = result['hists']
+for record in results:
+    if record.dimension == 2:
+        h2d.append(record.pull)
+        histnames2d.append(record.name)
+        run2d.append(f"d{record.data_run}; r{record.ref_run}")
 
-    for hist in hists:
-        histarr, histedge = root_numpy.hist2array(hist, return_edges=True)#, include_overflow=True)
-        if hist.InheritsFrom('TH2'):
-            h2d.append([histarr, histedge])
-            x = getBinCenter(histedge[0])
-            y = getBinCenter(histedge[1])
-            histnames2d.append(result['name'])
-            run2d.append(f"d{result['id'][40:46]}; r{result['id'][17:23]}")
+        #------------------ pull values vs nbins ------------------
 
-            #------------------ pull values vs nbins ------------------
+        hist2dnbins.append(record.nbins)
+        maxpulls.append(record.info['Max_Pull_Val'])
 
-            hist2dnbins.append(histarr.shape[0] * histarr.shape[1])
-            maxpulls.append(result['info']['Max_Pull_Val'])
+        #-------------------------------------------------------------
 
-            #-------------------------------------------------------------
+        #--------------------- pv vs nevents ------------------------------
 
-            #--------------------- pv vs nevents ------------------------------
+        nevents2ddata.append(record.info['Data_Entries'])
+        nevents2dref.append(record.info['Ref_Entries'])
 
-            nevents2ddata.append(result['info']['Data_Entries'])
-            nevents2dref.append(result['info']['Ref_Entries'])
+        #-------------------------------------------------------------
 
-            #-------------------------------------------------------------
 
+        #------------------------ chi2 ------------------------------------
 
-            #------------------------ chi2 ------------------------------------
+        chi22d.append(record.info['Chi_Squared'])
 
-            chi22d.append(result['info']['Chi_Squared'])
+        #----------------------------------------------------------------
 
-            #----------------------------------------------------------------
+    else:
+        h1d.append(record.data)
+        histnames1d.append(record.name)
+        run1d.append(f"d{record.data_run}; r{record.ref_run}")
 
-        elif hist.InheritsFrom('TH1'):
-            ## have to make this plot both the data and ref
-            ## looks like it returns the data first, but autodqm plots it second. this
-            ## doesn't really matter, just documenting
-            
-            histedge = histedge[0]
-            barval = getBinCenter(histedge)
-            histnames1d.append(result['name'])
-            run1d.append(f"d{result['id'][40:46]}; r{result['id'][17:23]}")
+        #------------------------ ks vs nbins ------------------------
 
-            #----------------- plotting autodqm output --------------------
+        hist1dnbins.append(record.nbins)
+        kss.append(record.info['KS_Val'])
 
-            ## this is a very jank way to check if it's data or ref, as data
-            ## is returned first
-            #if i < 1:
-            #    plt.bar(barval, histarr, label='data', color='m')
-            #else:
-                ## this is jank. it doesn't look nice but i should still be able
-                ## do analysis, it will be ugly
-            #    plt.bar(barval, histarr, label='ref', edgecolor='b', alpha=0.5, )
-            #plt.title(result['name'])
-            #plt.legend(loc='best')
-            #h1d.append([histarr,histedge])
-            #i = i+1
+        #-------------------------------------------------------------
 
-            #-------------------------------------------------------------
+        #------------------------ ks vs nevents ------------------------
 
+        nevents1ddata.append(record.info['Data_Entries'])
+        nevents1dref.append(record.info['Ref_Entries'])
 
-            #------------------------ ks vs nbins ------------------------
+        #-------------------------------------------------------------
 
-            hist1dnbins.append(histarr.shape[0])
-            kss.append(result['info']['KS_Val'])
+        #--------------------------- chi2& max pull ----------------------
 
-            #-------------------------------------------------------------
+        chi21d.append(record.info['Chi_Squared'])
+        maxpull1d.append(record.info['Max_Pull_Val'])
 
-            #------------------------ ks vs nevents ------------------------
+        #----------------------------------------------------------------
 
-            nevents1ddata.append(result['info']['Data_Entries'])
-            nevents1dref.append(result['info']['Ref_Entries'])
 
-            #-------------------------------------------------------------
 
-            #--------------------------- chi2& max pull ----------------------
-
-            chi21d.append(result['info']['Chi_Squared'])
-            maxpull1d.append(result['info']['Max_Pull_Val'])
-
-            #----------------------------------------------------------------
-
-
-    
 #------------------------- make pd of info, easy to mannip ------------------
 
 hists1d = pd.DataFrame(histnames1d)
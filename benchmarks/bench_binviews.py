@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Time to read the in-range bins of a filled TH2F as a flat float64 array,
+the way pullvals reads its data histogram: one bin at a time with
+GetBinContent, through bin_arrays, which copies every bin and computes the
+errors, and through bin_views, which copies the in-range bins once.
+
+Each method is called once untimed, then timed as the best of REPEAT calls.
+
+usage: bench_binviews.py [nbins_per_axis ...]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import ROOT
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'autodqm'))
+from histdata import bin_arrays, bin_views
+
+REPEAT = 5
+
+
+def make_hist(n):
+    h = ROOT.TH2F('h', '', n, 0, 1, n, 0, 1)
+    h.SetDirectory(0)
+    rand = ROOT.TRandom3(0)
+    for _ in range(10 * n * n):
+        h.Fill(rand.Rndm(), rand.Rndm())
+    return h
+
+
+def per_bin(h):
+    nx, ny = h.GetNbinsX(), h.GetNbinsY()
+    return np.array([h.GetBinContent(i, j)
+                     for i in range(1, nx + 1) for j in range(1, ny + 1)])
+
+
+def arrays(h):
+    vals, errs = bin_arrays(h)
+    return vals[1:-1, 1:-1].ravel()
+
+
+def views(h):
+    return bin_views(h, flow=False).contents.astype(
+        np.float64, order='C').ravel()
+
+
+def bench(func, h):
+    # Warm up, so that no method pays for first-call costs such as JIT
+    # compilation of the PyROOT bindings
+    out = func(h)
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        out = func(h)
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main(sizes):
+    print('best of {} calls, in ms'.format(REPEAT))
+    print('{:>9} {:>14} {:>14} {:>14}'.format(
+        'bins', 'GetBinContent', 'bin_arrays', 'bin_views'))
+    for n in sizes:
+        h = make_hist(n)
+        t_bin, ref = bench(per_bin, h)
+        t_arr, arr = bench(arrays, h)
+        t_view, view = bench(views, h)
+        assert np.array_equal(ref, arr) and np.array_equal(ref, view)
+        print('{:>9} {:>14.3f} {:>14.3f} {:>14.3f}'.format(
+            n * n, t_bin * 1e3, t_arr * 1e3, t_view * 1e3))
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [20, 100, 500])
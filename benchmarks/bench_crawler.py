@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Crawl time of DQMSession.crawl against one fetch_run_list call per
+sample, on a local stub server that serves synthetic listing pages with a
+fixed latency.
+
+usage: bench_crawler.py [latency_ms [macroruns_per_sample ...]]
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'autodqm'))
+import dqm
+
+SERIES = ('Run2017', 'Run2018')
+SAMPLES = ('L1T', 'ZeroBias', 'SingleMuon')
+RUNS_PER_DIR = 100
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves /, /<series>/, /<series>/<sample>/ and
+    /<series>/<sample>/<macrorun>/ listing pages."""
+    latency = 0.0
+    macroruns = 1
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        parts = [p for p in self.path.split('/') if p]
+        if len(parts) == 0:
+            rows = [(s + '/', '/{}/'.format(s), '-') for s in SERIES]
+        elif len(parts) == 1:
+            rows = [(s + '/', '/{}/{}/'.format(parts[0], s), '-')
+                    for s in SAMPLES]
+        elif len(parts) == 2:
+            rows = [('{:07d}xx/'.format(m), self.path + '{}/'.format(m), '-')
+                    for m in range(self.macroruns)]
+        else:
+            first = int(parts[2]) * RUNS_PER_DIR + 300000
+            rows = [('DQM_V0001_R000{}__{}__{}-v1__DQMIO.root'.format(
+                run, parts[1], parts[0]), '/file/{}'.format(run), 123456789)
+                for run in range(first, first + RUNS_PER_DIR)]
+        body = ''.join(
+            '<tr><td><a href="http://{}:{}{}">{}</a></td><td>{}</td>'
+            '<td>2018-06-01 00:00:00</td></tr>'.format(
+                *self.server.server_address, url, name, size)
+            for name, url, size in rows)
+        body = '<html><body><table>{}</table></body></html>'.format(body)
+        data = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_session(db):
+    # Skip fetching the CERN CA, the stub server is plain http
+    open(os.path.join(db, dqm.CA_PATH), 'w').close()
+    return dqm.DQMSession(None, db)
+
+
+def bench_fetch_run_list():
+    with tempfile.TemporaryDirectory() as db:
+        sess = make_session(db)
+        start = time.perf_counter()
+        nrows = sum(len(sess.fetch_run_list(series, sample))
+                    for series in SERIES for sample in SAMPLES)
+        return time.perf_counter() - start, nrows
+
+
+def bench_crawl(max_concurrent):
+    async def crawl(sess):
+        return len([row async for row in sess.crawl(
+            max_concurrent=max_concurrent)])
+
+    with tempfile.TemporaryDirectory() as db:
+        sess = make_session(db)
+        start = time.perf_counter()
+        nrows = asyncio.run(crawl(sess))
+        return time.perf_counter() - start, nrows
+
+
+def main(latency_ms, sizes):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    dqm.DQM_URL = 'http://{}:{}/'.format(*server.server_address)
+    StubHandler.latency = latency_ms / 1000
+
+    print('{} ms per page'.format(latency_ms))
+    print('{:>10} {:>8} {:>16} {:>12} {:>12} {:>9}'.format(
+        'macroruns', 'runs', 'fetch_run_list', 'crawl x4', 'crawl x16',
+        'speedup'))
+    for macroruns in sizes:
+        StubHandler.macroruns = macroruns
+        t_old, n_old = bench_fetch_run_list()
+        t_4, n_4 = bench_crawl(4)
+        t_16, n_16 = bench_crawl(16)
+        assert n_old == n_4 == n_16
+        print('{:>10} {:>8} {:>15.2f}s {:>11.2f}s {:>11.2f}s {:>8.1f}x'.format(
+            macroruns, n_old, t_old, t_4, t_16, t_old / t_16))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    main(latency, [int(n) for n in sys.argv[2:]] or [1, 10, 50])
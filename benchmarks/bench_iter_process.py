@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Peak RSS and time of compare_hists.process against iter_process as the
+number of configured histograms grows.
+
+Each size gets a synthetic subsystem of nhists 2D histograms in a data and
+a ref file. Every measurement runs in its own process, since peak RSS only
+ever grows, and the outputs of iter_process are dropped as they come, as a
+caller writing them out would.
+
+usage: bench_iter_process.py [render [nhists ...]]
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+AUTODQM = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                       'autodqm')
+PLUGINS = os.path.join(AUTODQM, '..', 'plugins')
+sys.path[1:1] = [AUTODQM, PLUGINS]
+
+SUBSYSTEM = 'Bench'
+MAIN_GDIR = 'DQMData/Run {0}/Bench/'
+NBINS = 100
+
+
+def make_inputs(dirname, nhists):
+    """Write the config and the data and ref files of nhists histograms,
+    and return the paths of the files."""
+    import ROOT
+    with open(os.path.join(dirname, SUBSYSTEM + '.json'), 'w') as f:
+        json.dump({'main_gdir': MAIN_GDIR,
+                   'hists': [{'path': 'H/h*',
+                              'comparators': ['pull_values']}]}, f)
+
+    rand = ROOT.TRandom3(0)
+    paths = []
+    for run in ('1', '2'):
+        path = os.path.join(dirname, '{}.root'.format(run))
+        tfile = ROOT.TFile.Open(path, 'RECREATE')
+        tdir = tfile.mkdir(MAIN_GDIR.format(run) + 'H')
+        tdir.cd()
+        for i in range(nhists):
+            h = ROOT.TH2F('h{}'.format(i), '', NBINS, 0, 1, NBINS, 0, 1)
+            for _ in range(1000):
+                h.Fill(rand.Rndm(), rand.Rndm())
+            h.Write()
+        tfile.Close()
+        paths.append(path)
+    return paths
+
+
+def measure(mode, dirname, render):
+    """Run process or iter_process on the inputs in dirname and print the
+    number of outputs, the seconds taken and the peak RSS in MB."""
+    import compare_hists
+    args = (dirname, SUBSYSTEM, 'Run2018', 'L1T', '1',
+            os.path.join(dirname, '1.root'),
+            'Run2018', 'L1T', '2', os.path.join(dirname, '2.root'))
+    kwargs = dict(output_dir=os.path.join(dirname, 'out'),
+                  plugin_dir=PLUGINS, render=render)
+
+    start = time.perf_counter()
+    if mode == 'process':
+        count = len(compare_hists.process(*args, **kwargs))
+    else:
+        count = sum(1 for _ in compare_hists.iter_process(*args, **kwargs))
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps([count, seconds, peak]))
+
+
+def main(render, sizes):
+    print('render={}'.format(render))
+    print('{:>7} {:>16} {:>16} {:>12} {:>12}'.format(
+        'hists', 'process MB', 'iter_process MB', 'process s',
+        'iter s'))
+    for nhists in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            make_inputs(tmp, nhists)
+            res = {}
+            for mode in ('process', 'iter_process'):
+                out = subprocess.run(
+                    [sys.executable, __file__, 'measure', mode, tmp, render],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                    check=True, universal_newlines=True).stdout
+                res[mode] = json.loads(out.strip().splitlines()[-1])
+            print('{:>7} {:>16.0f} {:>16.0f} {:>12.2f} {:>12.2f}'.format(
+                nhists, res['process'][2], res['iter_process'][2],
+                res['process'][1], res['iter_process'][1]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 5 and sys.argv[1] == 'measure':
+        measure(*sys.argv[2:])
+    else:
+        render = sys.argv[1] if len(sys.argv) > 1 else 'all'
+        main(render, [int(n) for n in sys.argv[2:]] or [50, 200, 800])
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Parse time of DQM listing pages with the fast row scanner against the
+lxml document tree, on synthetic macrorun pages of growing size.
+
+usage: bench_parser.py [rows ...]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'autodqm'))
+import dqm
+
+
+def make_page(nrows):
+    """Return a macrorun page listing nrows run files."""
+    rows = ''.join(
+        '<tr><td><a href="/dqm/offline/data/browse/ROOT/OfflineData/Run2018/'
+        'ZeroBias/0003200xx/DQM_V0001_R000{0}__ZeroBias__Run2018A-PromptReco'
+        '-v2__DQMIO.root">DQM_V0001_R000{0}__ZeroBias__Run2018A-PromptReco-v2'
+        '__DQMIO.root</a></td><td>{1}</td><td>Thu Jun 14 03:11:06 2018 UTC'
+        '</td></tr>\n'.format(300000 + i, 100000000 + i)
+        for i in range(nrows))
+    return ('<html><head><title>DQM</title></head><body><table>\n{}'
+            '</table></body></html>'.format(rows))
+
+
+def bench(parser, page, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = dqm._parse_dqm_page(page, parser)
+        best = min(best, time.perf_counter() - start)
+    return best, rows
+
+
+def main(sizes):
+    print('{:>8} {:>10} {:>10} {:>9} {:>14}'.format(
+        'rows', 'lxml', 'fast', 'speedup', 'fast rows/s'))
+    for nrows in sizes:
+        page = make_page(nrows)
+        repeat = max(3, 20000 // nrows)
+        t_lxml, rows_lxml = bench('lxml', page, repeat)
+        t_fast, rows_fast = bench('fast', page, repeat)
+        assert rows_fast == rows_lxml
+        print('{:>8} {:>9.2f}ms {:>9.2f}ms {:>8.1f}x {:>14,.0f}'.format(
+            nrows, t_lxml * 1e3, t_fast * 1e3, t_lxml / t_fast,
+            nrows / t_fast))
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [100, 1000, 10000, 50000])
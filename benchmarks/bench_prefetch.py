@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Wall time of walking runs in order with fetch_run and a comparison per
+run, against DQMSession.prefetch_runs, on a local stub server that serves a
+run listing and run files at a fixed bandwidth. The comparison is a sleep
+of fixed length.
+
+usage: bench_prefetch.py [runs [mb_per_run [mb_per_s [compare_s]]]]
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'autodqm'))
+import dqm
+
+SERIES = 'Run2018'
+SAMPLE = 'L1T'
+FIRST_RUN = 320000
+BLOCK = 1 << 16
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves a listing of one series, sample and macrorun directory, and
+    its run files at /file/<run> with byte ranges, at rate bytes/s."""
+    runs = 0
+    size = 0
+    rate = 0
+
+    def do_GET(self):
+        if self.path.startswith('/file/'):
+            return self._send_file()
+        base = 'http://{}:{}'.format(*self.server.server_address)
+        parts = [p for p in self.path.split('/') if p]
+        if len(parts) == 0:
+            rows = [(SERIES + '/', '/{}/'.format(SERIES), '-')]
+        elif len(parts) == 1:
+            rows = [(SAMPLE + '/', '/{}/{}/'.format(SERIES, SAMPLE), '-')]
+        elif len(parts) == 2:
+            rows = [('0003200xx/', '/{}/{}/0/'.format(SERIES, SAMPLE), '-')]
+        else:
+            rows = [('DQM_V0001_R000{}__{}__{}-v1__DQMIO.root'.format(
+                run, SAMPLE, SERIES), '/file/{}'.format(run), self.size)
+                for run in range(FIRST_RUN, FIRST_RUN + self.runs)]
+        body = ''.join(
+            '<tr><td><a href="{}{}">{}</a></td><td>{}</td>'
+            '<td>2018-06-01 00:00:00</td></tr>'.format(base, url, name, size)
+            for name, url, size in rows).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self):
+        m = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        start = int(m.group(1)) if m else 0
+        self.send_response(206 if m else 200)
+        if m:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, self.size - 1, self.size))
+        self.send_header('Content-Length', str(self.size - start))
+        self.end_headers()
+        block = b'\0' * BLOCK
+        sent = start
+        while sent < self.size:
+            n = min(BLOCK, self.size - sent)
+            self.wfile.write(block[:n])
+            sent += n
+            time.sleep(n / self.rate)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_session(db):
+    # Skip fetching the CERN CA, the stub server is plain http
+    open(os.path.join(db, dqm.CA_PATH), 'w').close()
+    return dqm.DQMSession(None, db)
+
+
+def bench_serial(runs, compare_s):
+    with tempfile.TemporaryDirectory() as db:
+        sess = make_session(db)
+        start = time.perf_counter()
+        for run in runs:
+            sess.fetch_run(SERIES, SAMPLE, run)
+            time.sleep(compare_s)
+        return time.perf_counter() - start, 0.0
+
+
+def bench_prefetch(runs, compare_s, **kwargs):
+    with tempfile.TemporaryDirectory() as db:
+        sess = make_session(db)
+        start = time.perf_counter()
+        waited = 0.0
+        for pr in sess.prefetch_runs(SERIES, SAMPLE, runs, **kwargs):
+            waited += pr.wait
+            time.sleep(compare_s)
+        return time.perf_counter() - start, waited
+
+
+def main(nruns, mb_per_run, mb_per_s, compare_s):
+    StubHandler.runs = nruns
+    StubHandler.size = int(mb_per_run * 1e6)
+    StubHandler.rate = mb_per_s * 1e6
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    dqm.DQM_URL = 'http://{}:{}/'.format(*server.server_address)
+    runs = [str(FIRST_RUN + i) for i in range(nruns)]
+
+    print('{} runs of {} MB at {} MB/s, {} s per comparison'.format(
+        nruns, mb_per_run, mb_per_s, compare_s))
+    print('{:>38} {:>9} {:>9}'.format('mode', 'seconds', 'waited'))
+    for mode, func in (
+            ('fetch_run', lambda: bench_serial(runs, compare_s)),
+            ('prefetch_runs', lambda: bench_prefetch(runs, compare_s)),
+            ('prefetch_runs, max_rate/2', lambda: bench_prefetch(
+                runs, compare_s, max_rate=StubHandler.rate / 2)),
+            ('prefetch_runs, max_ahead_bytes 1 run', lambda: bench_prefetch(
+                runs, compare_s, ahead=4,
+                max_ahead_bytes=StubHandler.size))):
+        seconds, waited = func()
+        print('{:>38} {:>8.2f}s {:>8.2f}s'.format(mode, seconds, waited))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    args = [float(a) for a in sys.argv[1:]]
+    defaults = [8, 2, 10, 0.2]
+    nruns, mb_per_run, mb_per_s, compare_s = args + defaults[len(args):]
+    main(int(nruns), mb_per_run, mb_per_s, compare_s)
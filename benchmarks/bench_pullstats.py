@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Throughput of the pullstats kernel against the former per-bin
+implementation, which called TMath once or twice for every bin.
+
+usage: bench_pullstats.py [nbins ...]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import ROOT
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'autodqm'))
+import pullstats
+
+
+def legacy_maxPullNorm(maxPull, nBinsUsed):
+    prob = ROOT.TMath.Prob(np.power(maxPull, 2),1)
+    probNorm = 1-np.power((1-prob),nBinsUsed)
+    ## .9999999999999999 is the max that can go into chi2quantile
+    val = (1-probNorm)
+    val = val if val < .9999999999999999 else .9999999999999999
+    return np.sqrt(ROOT.TMath.ChisquareQuantile(val,1))
+
+
+def legacy_pull_map(bin1, bin1err, bin2, bin2err, nBinsUsed):
+    new_pull = np.zeros(len(bin1))
+    for i in range(len(bin1)):
+        if bin1err[i] == 0 and bin2err[i] == 0:
+            continue
+        new_pull[i] = legacy_maxPullNorm(
+            pullstats.pull(bin1[i], bin1err[i], bin2[i], bin2err[i]),
+            nBinsUsed[i])
+    return new_pull
+
+
+def make_bins(nbins, seed=0):
+    """Return poisson-like data and ref bins with a few hot spots."""
+    rng = np.random.default_rng(seed)
+    bin2 = rng.poisson(50, nbins).astype(np.float64)
+    bin1 = rng.poisson(50, nbins).astype(np.float64)
+    hot = rng.choice(nbins, max(1, nbins // 1000), replace=False)
+    bin1[hot] *= 2
+    nBinsUsed = np.cumsum(bin1 + bin2 > 0)
+    return bin1, np.sqrt(bin1), bin2, np.sqrt(bin2), nBinsUsed
+
+
+def bench(func, args, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main(sizes):
+    # Let ROOT JIT the TMath calls before anything is timed
+    legacy_pull_map(*make_bins(10))
+
+    print('{:>9} {:>15} {:>15} {:>9} {:>12}'.format(
+        'nbins', 'legacy bins/s', 'kernel bins/s', 'speedup', 'max |diff|'))
+    for nbins in sizes:
+        args = make_bins(nbins)
+        t_old, old = bench(legacy_pull_map, args, 1)
+        t_new, new = bench(pullstats.pull_map, args, 5)
+        diff = np.max(np.abs(old - new), initial=0)
+        print('{:>9} {:>15.0f} {:>15.0f} {:>8.0f}x {:>12.2e}'.format(
+            nbins, nbins / t_old, nbins / t_new, t_old / t_new, diff))
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [100, 1000, 10000, 100000])
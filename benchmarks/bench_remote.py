@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Bytes and requests that remote.read_hists takes to read the configured
+histograms of a run, against downloading the whole file, from a local HTTP
+server with byte-range support.
+
+The run file is a copy of root_file with filler directories of histograms
+added under the run's main directory, standing in for the other subsystems
+of a real DQM file. The server runs in its own process, since PyROOT holds
+the GIL while ROOT waits for it. The histograms read are checked against
+those of the local file.
+
+usage: bench_remote.py config_dir subsystem run root_file [filler_dirs]
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'autodqm'))
+
+FILLER_HISTS = 20
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves the files of a directory with single byte-range requests, and
+    the number of requests and bytes served so far at /stats."""
+    root = None
+    stats = {'requests': 0, 'bytes': 0}
+
+    def do_HEAD(self):
+        size = os.path.getsize(self._path())
+        self.send_response(200)
+        self.send_header('Content-Length', str(size))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/stats':
+            return self._send(200, json.dumps(self.stats).encode())
+        with open(self._path(), 'rb') as f:
+            data = f.read()
+        m = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if not m:
+            return self._send(200, data)
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else len(data) - 1
+        self._send(206, data[start:end + 1], 'bytes {}-{}/{}'.format(
+            start, end, len(data)))
+
+    def _send(self, status, body, content_range=None):
+        if not self.path.endswith('/stats'):
+            self.stats['requests'] += 1
+            self.stats['bytes'] += len(body)
+        self.send_response(status)
+        if content_range:
+            self.send_header('Content-Range', content_range)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path(self):
+        return os.path.join(self.root, urlparse(self.path).path.lstrip('/'))
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, root):
+    RangeHandler.root = root
+    ThreadingHTTPServer(('127.0.0.1', int(port)), RangeHandler).serve_forever()
+
+
+def make_file(src, dest, main_gdir, filler_dirs):
+    """Copy the DQM file src to dest and add filler_dirs directories of
+    filled histograms next to the subsystem directory."""
+    import ROOT
+    ROOT.TFile.Cp(src, dest, False)
+    tfile = ROOT.TFile.Open(dest, 'UPDATE')
+    parent = tfile.GetDirectory(main_gdir.rstrip('/').rpartition('/')[0])
+    rand = ROOT.TRandom3(0)
+    for i in range(filler_dirs):
+        tdir = parent.mkdir('Filler{}'.format(i))
+        tdir.cd()
+        for j in range(FILLER_HISTS):
+            h = ROOT.TH2F('h{}'.format(j), '', 100, 0, 1, 100, 0, 1)
+            for _ in range(2000):
+                h.Fill(rand.Rndm(), rand.Rndm())
+            h.Write()
+    tfile.Close()
+
+
+def digests(hists):
+    import hashlib
+    import histdata
+    out = {}
+    for path, hd in hists.items():
+        h = hashlib.sha1()
+        histdata.update_digest(h, hd)
+        out[path] = h.hexdigest()
+    return out
+
+
+def local_hists(config_dir, subsystem, run, path):
+    """Return {path below main_gdir: HistData} of the configured
+    histograms of the local file at path."""
+    import ROOT
+    import cfg
+    import histdata
+    import keyindex
+    main_gdir = cfg.get_subsystem(config_dir, subsystem)['main_gdir'].format(
+        run)
+    tfile = ROOT.TFile.Open(path)
+    index = keyindex.KeyIndex(tfile, main_gdir)
+    hists = {}
+    for hconf in cfg.get_subsystem(config_dir, subsystem)['hists']:
+        h = hconf['path'].split('/')[-1]
+        dirname = main_gdir + hconf['path'][:-len(h)]
+        for info in index.glob(dirname, h):
+            hists.setdefault((dirname + info.name)[len(main_gdir):],
+                             histdata.from_hist(tfile.Get(
+                                 dirname + info.name)))
+    tfile.Close()
+    return hists
+
+
+def stats(base):
+    import requests
+    return requests.get(base + 'stats').json()
+
+
+def main(config_dir, subsystem, run, root_file, filler_dirs):
+    import requests
+    import cfg
+    import remote
+    from result_cache import ResultCache
+
+    main_gdir = cfg.get_subsystem(config_dir, subsystem)['main_gdir']
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.basename(root_file)
+        make_file(root_file, os.path.join(tmp, name), main_gdir.format(run),
+                  filler_dirs)
+        size = os.path.getsize(os.path.join(tmp, name))
+
+        port = '8790'
+        server = subprocess.Popen(
+            [sys.executable, __file__, 'serve', port, tmp])
+        try:
+            base = 'http://127.0.0.1:{}/'.format(port)
+            for _ in range(50):
+                try:
+                    stats(base)
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+
+            cache = ResultCache(os.path.join(tmp, 'cache'))
+            print('{} bytes, {} filler directories'.format(size, filler_dirs))
+            print('{:>22} {:>9} {:>12} {:>9}'.format(
+                'mode', 'requests', 'bytes', 'seconds'))
+
+            def row(mode, func):
+                before = stats(base)
+                start = time.perf_counter()
+                func()
+                seconds = time.perf_counter() - start
+                after = stats(base)
+                print('{:>22} {:>9} {:>12} {:>9.3f}'.format(
+                    mode, after['requests'] - before['requests'],
+                    after['bytes'] - before['bytes'], seconds))
+
+            row('download', lambda: requests.get(base + name).content)
+            read = {}
+            for mode in ('remote, cold cache', 'remote, warm cache'):
+                row(mode, lambda: read.setdefault(mode, remote.read_hists(
+                    config_dir, subsystem, run, base + name, cache=cache)))
+            local = digests(local_hists(config_dir, subsystem, run,
+                                        os.path.join(tmp, name)))
+            print('same histograms as the local file: {}'.format(all(
+                digests(hists) == local for hists in read.values())))
+        finally:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'serve':
+        serve(*sys.argv[2:])
+    elif len(sys.argv) in (5, 6):
+        main(*sys.argv[1:5],
+             int(sys.argv[5]) if len(sys.argv) == 6 else 50)
+    else:
+        sys.exit("usage: bench_remote.py config_dir subsystem run root_file "
+                 "[filler_dirs]")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Wall time of comparing every subsystem of a pair of runs with one
+compare_hists.process call per subsystem, against a single
+process_subsystems pass, and whether both give the same outputs.
+
+Each synthetic subsystem has a directory of configured 2D histograms and
+filler directories of histograms no config asks for, as in a real DQM file.
+
+usage: bench_subsystems.py [subsystems [hists [filler_dirs]]]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+AUTODQM = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                       'autodqm')
+PLUGINS = os.path.join(AUTODQM, '..', 'plugins')
+sys.path[1:1] = [AUTODQM, PLUGINS]
+
+MAIN_GDIR = 'DQMData/Run {0}/Sub{1}/Run summary/'
+FILLER_HISTS = 20
+NBINS = 50
+
+
+def make_inputs(dirname, nsubs, nhists, filler_dirs):
+    """Write the configs of nsubs subsystems and the data and ref files,
+    and return the names of the subsystems."""
+    import ROOT
+    names = ['Sub{}'.format(i) for i in range(nsubs)]
+    for i, name in enumerate(names):
+        with open(os.path.join(dirname, name + '.json'), 'w') as f:
+            json.dump({'main_gdir': MAIN_GDIR.replace('{1}', str(i)),
+                       'hists': [{'path': 'H/h*',
+                                  'comparators': ['pull_values']}]}, f)
+
+    rand = ROOT.TRandom3(0)
+    for run in ('1', '2'):
+        tfile = ROOT.TFile.Open(os.path.join(dirname, run + '.root'),
+                                'RECREATE')
+        for i in range(nsubs):
+            top = MAIN_GDIR.format(run, i)
+            for sub, count in [('H', nhists)] + [
+                    ('F{}'.format(j), FILLER_HISTS)
+                    for j in range(filler_dirs)]:
+                tfile.mkdir(top + sub).cd()
+                for k in range(count):
+                    h = ROOT.TH2F('h{}'.format(k), '', NBINS, 0, 1,
+                                  NBINS, 0, 1)
+                    for _ in range(200):
+                        h.Fill(rand.Rndm(), rand.Rndm())
+                    h.Write()
+        tfile.Close()
+    return names
+
+
+def summary(outputs):
+    return [(out['id'], out['info'], out['display']) for out in outputs]
+
+
+def main(nsubs, nhists, filler_dirs):
+    import compare_hists
+    with tempfile.TemporaryDirectory() as tmp:
+        names = make_inputs(tmp, nsubs, nhists, filler_dirs)
+        args = ('Run2018', 'L1T', '1', os.path.join(tmp, '1.root'),
+                'Run2018', 'L1T', '2', os.path.join(tmp, '2.root'))
+        kwargs = dict(output_dir=os.path.join(tmp, 'out'),
+                      plugin_dir=PLUGINS, render='none')
+        # Load the plugins and let ROOT warm up before anything is timed
+        compare_hists.process(tmp, names[0], *args, **kwargs)
+
+        start = time.perf_counter()
+        single = {name: summary(compare_hists.process(
+            tmp, name, *args, **kwargs)) for name in names}
+        t_single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        multi = {name: summary(outputs) for name, outputs in
+                 compare_hists.process_subsystems(
+                     tmp, None, *args, **kwargs).items()}
+        t_multi = time.perf_counter() - start
+
+    print('{} subsystems of {} histograms, {} filler directories each'.format(
+        nsubs, nhists, filler_dirs))
+    print('{:>20} {:>9}'.format('mode', 'seconds'))
+    print('{:>20} {:>9.2f}'.format('process each', t_single))
+    print('{:>20} {:>9.2f}'.format('process_subsystems', t_multi))
+    print('same outputs: {}'.format(single == multi))
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    defaults = [9, 10, 20]
+    main(*(args + defaults[len(args):]))
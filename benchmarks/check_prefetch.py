@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Check that DQMSession.prefetch_runs raises, rather than waits forever,
+when the handling of a run fails in its download thread, and that run
+files it may not touch or remove, as on a db shared between users, count
+as missing and stay in the db.
+
+The runs are already in the db, so no request is made.
+
+usage: check_prefetch.py
+"""
+
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'autodqm'))
+import dqm
+
+SERIES = 'Run2018'
+SAMPLE = 'L1T'
+RUNS = ['1', '2', '3']
+SIZE = 1 << 10
+# Seconds to wait for prefetch_runs before it counts as hung
+TIMEOUT = 10
+
+
+def consume(sess):
+    """Walk prefetch_runs over RUNS in a thread, and return the runs it
+    yielded and the exception it raised, or None if it hung."""
+    out = {}
+
+    def walk():
+        runs = []
+        try:
+            for prefetched in sess.prefetch_runs(SERIES, SAMPLE, RUNS):
+                runs.append(prefetched.run)
+        except Exception as e:
+            out['result'] = (runs, e)
+        else:
+            out['result'] = (runs, None)
+
+    thread = threading.Thread(target=walk, daemon=True)
+    thread.start()
+    thread.join(TIMEOUT)
+    return out.get('result')
+
+
+def check_raises(db, name, patch):
+    sess = make_session(db)
+    patch(sess)
+    result = consume(sess)
+    if result is None:
+        ok = False
+        outcome = 'hung'
+    else:
+        runs, exc = result
+        ok = runs == ['1'] and isinstance(exc, dqm.error)
+        outcome = 'yielded {}, raised {!r}'.format(runs, exc)
+    print('{:>36}: {} ({})'.format(name, 'ok' if ok else 'FAILED', outcome))
+    return ok
+
+
+def check_not_permitted(db):
+    """Run files that may not be touched count as missing, and those that
+    may not be removed are skipped by evict_runs."""
+    sess = make_session(db)
+    sess.max_bytes = 0
+    paths = [sess._run_path(SERIES, SAMPLE, run) for run in RUNS]
+    utime, remove = os.utime, os.remove
+
+    def deny(func):
+        def call(path, *args, **kwargs):
+            if path == paths[1]:
+                raise PermissionError(path)
+            return func(path, *args, **kwargs)
+        return call
+
+    os.utime, os.remove = deny(utime), deny(remove)
+    try:
+        touched = [sess._touch_run(path) for path in paths]
+        removed = sess.evict_runs()
+    finally:
+        os.utime, os.remove = utime, remove
+    left = [os.path.exists(path) for path in paths]
+    ok = (touched == [True, False, True] and removed == 2 * SIZE
+          and left == [False, True, False])
+    print('{:>36}: {} (touched {}, removed {} bytes, left {})'.format(
+        'not permitted', 'ok' if ok else 'FAILED', touched, removed, left))
+    return ok
+
+
+def make_session(db):
+    for run in RUNS:
+        path = os.path.join(db, SERIES, SAMPLE, run + '.root')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'\0' * SIZE)
+    return dqm.DQMSession(None, db)
+
+
+def main():
+    def touch_fails(sess):
+        touch = sess._touch_run
+
+        def call(path):
+            if path.endswith('/2.root'):
+                raise OSError('touch failed')
+            return touch(path)
+        sess._touch_run = call
+
+    def evict_fails(sess):
+        # Runs are evicted for in order, so the second call is for run 2
+        calls = []
+        evict = sess.evict_runs
+
+        def call(keep=()):
+            calls.append(keep)
+            if len(calls) == 2:
+                raise OSError('eviction failed')
+            return evict(keep=keep)
+        sess.evict_runs = call
+
+    with tempfile.TemporaryDirectory() as db:
+        # Skip fetching the CERN CA, no request is made
+        open(os.path.join(db, dqm.CA_PATH), 'w').close()
+        results = [
+            check_raises(db, 'touch raises', touch_fails),
+            check_raises(db, 'eviction raises', evict_fails),
+            check_not_permitted(db),
+        ]
+    return all(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Check that DQMSession resumes an interrupted run file download only
+while the file on the server is the one its part file was written from,
+against a local stub server that honours Range and If-Range.
+
+Each case interrupts a download, or leaves a part file behind, possibly
+changes the file on the server, downloads again and compares the result
+with the server's file and the requests made with the ones expected.
+
+usage: check_resume.py
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import re
+import sys
+import tempfile
+import threading
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'autodqm'))
+import dqm
+
+SIZE = 1 << 20
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves content at any path with byte ranges, and with etag and
+    last_modified as validators where set. Each request is logged as
+    (Range, If-Range, status)."""
+    content = b''
+    etag = None
+    last_modified = None
+    log = []
+
+    def do_GET(self):
+        cls = type(self)
+        size = len(cls.content)
+        m = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if m and if_range is not None and if_range not in (
+                cls.etag, cls.last_modified):
+            # The file changed, send all of it
+            m = None
+        start = int(m.group(1)) if m else 0
+
+        if m and start >= size:
+            status = 416
+            self.send_response(status)
+            self.send_header('Content-Range', 'bytes */{}'.format(size))
+            self.send_header('Content-Length', '0')
+        else:
+            status = 206 if m else 200
+            self.send_response(status)
+            if m:
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                    start, size - 1, size))
+            self.send_header('Content-Length', str(size - start))
+        if cls.etag:
+            self.send_header('ETag', cls.etag)
+        if cls.last_modified:
+            self.send_header('Last-Modified', cls.last_modified)
+        self.end_headers()
+        cls.log.append((self.headers.get('Range'), if_range, status))
+        if status != 416:
+            self.wfile.write(cls.content[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(content, etag='"v1"', last_modified=None):
+    StubHandler.content = content
+    StubHandler.etag = etag
+    StubHandler.last_modified = last_modified
+    StubHandler.log = []
+
+
+def interrupt(sess, url, dest, reads=3):
+    """Start a download and stop it after a few reads, leaving its part
+    file behind."""
+    dl = sess._stream_file(url, dest)
+    for _, prog in zip(range(reads + 1), dl):
+        pass
+    dl.close()
+    return prog.cur
+
+
+def run_case(sess, url, db, name, setup, expected_log):
+    dest = os.path.join(db, name.replace(' ', '_') + '.root')
+    setup(dest)
+    StubHandler.log = []
+    for _ in sess._stream_file(url, dest):
+        pass
+    with open(dest, 'rb') as f:
+        same = f.read() == StubHandler.content
+    leftover = [p for p in (dest + dqm.PART_EXT,
+                            dest + dqm.PART_EXT + dqm.VALIDATOR_EXT)
+                if os.path.exists(p)]
+    log = [status for _, _, status in StubHandler.log]
+    ok = same and not leftover and log == expected_log
+    print('{:>36}: {} (requests {}, file {}, leftover {})'.format(
+        name, 'ok' if ok else 'FAILED', log,
+        'same' if same else 'differs', leftover or 'none'))
+    return ok
+
+
+def main():
+    v1 = os.urandom(SIZE)
+    v2 = os.urandom(SIZE)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://{}:{}/file'.format(*server.server_address)
+
+    def interrupted(etag='"v1"', last_modified=None, then=None):
+        def setup(dest):
+            serve(v1, etag, last_modified)
+            interrupt(sess, url, dest)
+            if then is not None:
+                then()
+        return setup
+
+    def part_without_validator(dest):
+        serve(v1)
+        with open(dest + dqm.PART_EXT, 'wb') as f:
+            f.write(v1[:SIZE // 2])
+
+    def complete_part(dest):
+        serve(v1)
+        interrupt(sess, url, dest)
+        with open(dest + dqm.PART_EXT, 'wb') as f:
+            f.write(v1)
+
+    cases = [
+        ('unchanged, resumed', interrupted(), [206]),
+        ('changed etag, restarted', interrupted(
+            then=lambda: serve(v2, '"v2"')), [200]),
+        ('changed last-modified, restarted', interrupted(
+            etag=None, last_modified='Fri, 01 Jun 2018 00:00:00 GMT',
+            then=lambda: serve(v2, None, 'Sat, 02 Jun 2018 00:00:00 GMT')),
+         [200]),
+        ('weak etag, resumed by last-modified', interrupted(
+            etag='W/"v1"', last_modified='Fri, 01 Jun 2018 00:00:00 GMT'),
+         [206]),
+        ('no validator, not resumed', part_without_validator, [200]),
+        ('complete part file', complete_part, [416]),
+    ]
+
+    with tempfile.TemporaryDirectory() as db:
+        # Skip fetching the CERN CA, the stub server is plain http
+        open(os.path.join(db, dqm.CA_PATH), 'w').close()
+        sess = dqm.DQMSession(None, db)
+        results = [run_case(sess, url, db, name, setup, expected)
+                   for name, setup, expected in cases]
+    server.shutdown()
+    return all(results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
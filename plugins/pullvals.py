@@ -3,8 +3,10 @@
 import ROOT
 #from autodqm.plugin_results import PluginResults
 from plugin_results import PluginResults
+from histdata import (HistData, axis_data, bin_arrays, bin_views,
+                      set_bin_arrays, to_hist)
+from pullstats import pull_map
 import numpy as np
-import time
 
 def comparators():
     return {
@@ -12,10 +14,20 @@ def comparators():
     }
 
 
+def renderers():
+    return {
+        'pull_values': draw_pullvals
+    }
+
+
 def pullvals(histpair,
              pull_cap=25, chi2_cut=500, pull_cut=20, min_entries=100000, norm_type='all',
-             **kwargs):
-    """Can handle poisson driven TH2s or generic TProfile2Ds"""
+             log_tail=False, **kwargs):
+    """Can handle poisson driven TH2s or generic TProfile2Ds
+
+    Pulls saturate at pullstats.SATURATED_PULL unless log_tail is set, so
+    that by default max_pull stays below pull_cut and chi2 below chi2_cut.
+    Set the cuts to match when turning log_tail on."""
     data_hist = histpair.data_hist
     ref_hist = histpair.ref_hist
 
@@ -28,78 +40,63 @@ def pullvals(histpair,
     if data_hist.GetDimension() != 2 or ref_hist.GetDimension() != 2:
         return None
 
-    ROOT.gStyle.SetOptStat(0)
-    ROOT.gStyle.SetPalette(ROOT.kLightTemperature)
-    ROOT.gStyle.SetNumberContours(255)
-
-    # Get empty clone of reference histogram for pull hist
-    if ref_hist.InheritsFrom('TProfile2D'):
-        pull_hist = ref_hist.ProjectionXY("pull_hist")
-    else:
-        pull_hist = ref_hist.Clone("pull_hist")
-    pull_hist.Reset()
-
     # Reject empty histograms
     is_good = data_hist.GetEntries() != 0 and data_hist.GetEntries() >= min_entries
 
+    ref = histpair.ref_prep
+
     # Normalize data_hist
     if norm_type == "row":
-        normalize_rows(data_hist, ref_hist)
+        normalize_rows(data_hist, ref.row_sums)
     else:
         if data_hist.GetEntries() > 0:
-            data_hist.Scale(ref_hist.GetSumOfWeights() / data_hist.GetSumOfWeights())
-
-    max_pull = 0
-    nBins = 0
-    nBinsUsed = 0
-    chi2 = 0
-    for x in range(1, ref_hist.GetNbinsX() + 1):
-        for y in range(1, ref_hist.GetNbinsY() + 1):
-
-            # Bin 1 data
-            bin1 = data_hist.GetBinContent(x, y)
-
-            # Bin 2 data
-            bin2 = ref_hist.GetBinContent(x, y)
-            
-            if bin1 + bin2 < 1:
-                continue
-            
-            # TEMPERARY - Getting Symmetric Error - Need to update with >Proper Poisson error 
-            if ref_hist.InheritsFrom('TProfile2D'):
-                bin1err = data_hist.GetBinError(x, y)
-                bin2err = ref_hist.GetBinError(x, y)
-            else:
-                bin1err, bin2err = bin1**(.5), bin2**(.5)
-
-            # Count bins for chi2 calculation
-            nBins += 1
-            if (bin1+bin2) > 0: nBinsUsed +=1 
-            
-            # Ensure that divide-by-zero error is not thrown when calculating pull
-            if bin1err == 0 and bin2err == 0:
-                new_pull = 0
-            else:
-                new_pull = pull(bin1, bin1err, bin2, bin2err)
-                new_pull = maxPullNorm(new_pull, nBinsUsed)
-
-            # Sum pulls
-            chi2 += new_pull**2
-
-            # Check if max_pull
-            max_pull = max(max_pull, abs(new_pull))
-            #max_pull = maxPullNorm(max_pull, nBinsUsed)
-
-            # Clamp the displayed value
-            fill_val = max(min(new_pull, pull_cap), -pull_cap)
-
-            # If the input bins were explicitly empty, make this bin white by
-            # setting it out of range
-            if bin1 == bin2 == 0:
-                fill_val = -999
-
-            # Fill Pull Histogram
-            pull_hist.SetBinContent(x, y, fill_val)
+            data_hist.Scale(ref.sumw / data_hist.GetSumOfWeights())
+
+    # Pull bin contents out as (nbinsx, nbinsy) arrays, so that flattening
+    # them visits bins in the same x-major order as a nested bin loop. The
+    # data bins are read through views and copied once, in range only
+    nx, ny = ref_hist.GetNbinsX(), ref_hist.GetNbinsY()
+    data = bin_views(data_hist, flow=False)
+    bin1 = data.contents[:nx, :ny].astype(np.float64, order='C').ravel()
+    bin2 = ref.vals[1:nx + 1, 1:ny + 1].ravel()
+
+    # TEMPERARY - Getting Symmetric Error - Need to update with >Proper Poisson error 
+    if ref_hist.InheritsFrom('TProfile2D'):
+        bin1err = data.errors[:nx, :ny].ravel()
+        bin2err = ref.errs[1:nx + 1, 1:ny + 1].ravel()
+    else:
+        bin1err, bin2err = np.sqrt(bin1), np.sqrt(bin2)
+
+    # Only bins with content in either histogram are counted
+    used = bin1 + bin2 >= 1
+    nBinsUsed = int(np.count_nonzero(used))
+
+    new_pull = np.zeros_like(bin1)
+    new_pull[used] = pull_map(bin1[used], bin1err[used],
+                              bin2[used], bin2err[used],
+                              np.arange(1, nBinsUsed + 1), log_tail)
+
+    # Sum pulls
+    chi2 = float(np.sum(np.square(new_pull[used])))
+
+    # Check if max_pull
+    max_pull = float(np.max(np.abs(new_pull[used]), initial=0))
+
+    # Clamp the displayed value
+    fill_vals = np.clip(new_pull, -pull_cap, pull_cap)
+
+    # Fill Pull Histogram, leaving skipped bins empty. It takes the binning
+    # of the reference, or of its projection for TProfile2Ds
+    fill_vals[~used] = 0
+    pull_vals = np.zeros((nx + 2, ny + 2))
+    pull_vals[1:nx + 1, 1:ny + 1] = fill_vals.reshape(nx, ny)
+    if ref_hist.InheritsFrom('TProfile2D'):
+        pull_class = 'TH2D'
+    else:
+        pull_class = ref_hist.ClassName()
+    pull_hist = HistData("pull_hist", ref_hist.GetTitle() + " Pull Values",
+                         pull_class, axis_data(ref_hist), pull_vals, None,
+                         0, None, None)
 
     # Compute chi2
     #chi2 = (chi2 / nBins)
@@ -111,96 +108,73 @@ def pullvals(histpair,
     
     is_outlier = is_good and (chi2 > chi2_cut or abs(max_pull) > pull_cut)
 
+    info = {
+        'Chi_Squared': chi2,
+        'Max_Pull_Val': max_pull,
+        'Data_Entries': data_hist.GetEntries(),
+        'Ref_Entries': ref.entries,
+    }
+
+    plot = {
+        'pull_hist': pull_hist,
+        'data_run': histpair.data_run,
+        'ref_run': histpair.ref_run,
+        'pull_cap': pull_cap,
+    }
+
+    return PluginResults(
+        show=is_outlier,
+        info=info,
+        plot=plot)
+
+
+def draw_pullvals(pull_hist, data_run, ref_run, pull_cap=25):
+    """Draw the pull map of a pullvals result from its HistData."""
+    ROOT.gStyle.SetOptStat(0)
+    ROOT.gStyle.SetPalette(ROOT.kLightTemperature)
+    ROOT.gStyle.SetNumberContours(255)
+
+    pull_hist = to_hist(pull_hist)
+
     # Set up canvas
     c = ROOT.TCanvas('c', 'Pull')
 
     # Plot pull hist
     pull_hist.GetZaxis().SetRangeUser(-(pull_cap), pull_cap)
-    pull_hist.SetTitle(pull_hist.GetTitle() + " Pull Values")
     pull_hist.Draw("colz")
 
     # Text box
     data_text = ROOT.TLatex(.52, .91,
-                            "#scale[0.6]{Data: " + str(histpair.data_run) + "}")
+                            "#scale[0.6]{Data: " + str(data_run) + "}")
     ref_text = ROOT.TLatex(.72, .91,
-                           "#scale[0.6]{Ref: " + str(histpair.ref_run) + "}")
+                           "#scale[0.6]{Ref: " + str(ref_run) + "}")
     data_text.SetNDC(ROOT.kTRUE)
     ref_text.SetNDC(ROOT.kTRUE)
     data_text.Draw()
     ref_text.Draw()
 
-    info = {
-        'Chi_Squared': chi2,
-        'Max_Pull_Val': max_pull,
-        'Data_Entries': data_hist.GetEntries(),
-        'Ref_Entries': ref_hist.GetEntries(),
-    }
+    return c, [pull_hist, data_text, ref_text]
 
-    artifacts = [pull_hist, data_text, ref_text]
 
-    return PluginResults(
-        c,
-        show=is_outlier,
-        info=info,
-        artifacts=artifacts)
-
-
-def pull(bin1, binerr1, bin2, binerr2):
-    ''' Calculate the pull value between two bins.
-        pull = (data - expected)/sqrt(sum of errors in quadrature))
-        data = |bin1 - bin2|, expected = 0
-    '''
-    ## changing to pull with tolerance
-    # return (bin1 - bin2) / ((binerr1**2 + binerr2**2)**0.5)
-    return np.abs(bin1 - bin2)/(np.sqrt(np.power(binerr1,2)+np.power(binerr2,2)+0.01*(bin1+bin2)))
-
-def maxPullNorm(maxPull, nBinsUsed):
-    prob = ROOT.TMath.Prob(np.power(maxPull, 2),1)
-    probNorm = 1-np.power((1-prob),nBinsUsed)
-    ## .9999999999999999 is the max that can go into chi2quantile
-    val = (1-probNorm) 
-    val = val if val < .9999999999999999 else .9999999999999999
-    return np.sqrt(ROOT.TMath.ChisquareQuantile(val,1))
-    
+def normalize_rows(data_hist, rrow):
+    """Scale each y row of data_hist to the ref row sums rrow."""
+    data_vals, data_errs = bin_arrays(data_hist)
+    ny = len(rrow)
+
+    # Sum of row elements
+    frow = data_vals[1:-1, 1:ny + 1].sum(axis=0)
+
+    # Scaling factors
+    # Prevent divide-by-zero error
+    frow[frow == 0] = 1
+    sf = np.ones_like(frow)
+    np.divide(rrow, frow, out=sf, where=frow > 0)
+    # Prevent scaling everything to zero
+    sf[sf == 0] = 1
 
-def normalize_rows(data_hist, ref_hist):
-
-    for y in range(1, ref_hist.GetNbinsY() + 1):
-
-        # Stores sum of row elements
-        rrow = 0
-        frow = 0
-
-        # Sum over row elements
-        for x in range(1, ref_hist.GetNbinsX() + 1):
-
-            # Bin data
-            rbin = ref_hist.GetBinContent(x, y)
-            fbin = data_hist.GetBinContent(x, y)
-
-            rrow += rbin
-            frow += fbin
-
-        # Scaling factors
-        # Prevent divide-by-zero error
-        if frow == 0:
-            frow = 1
-        if frow > 0:
-            sf = float(rrow) / frow
-        else:
-            sf = 1
-        # Prevent scaling everything to zero
-        if sf == 0:
-            sf = 1
-
-        # Normalization
-        for x in range(1, data_hist.GetNbinsX() + 1):
-            # Bin data
-            fbin = data_hist.GetBinContent(x, y)
-            fbin_err = data_hist.GetBinError(x, y)
-
-            # Normalize bin
-            data_hist.SetBinContent(x, y, (fbin * sf))
-            data_hist.SetBinError(x, y, (fbin_err * sf))
+    # Normalization
+    data_vals[1:-1, 1:ny + 1] *= sf
+    data_errs[1:-1, 1:ny + 1] *= sf
+    set_bin_arrays(data_hist, data_vals, data_errs)
 
     return